@@ -1,5 +1,7 @@
 class Book:
     books_properties = ["title", "author", "price", "year", "genres"]
+    # Books are created for every book sent to the store, keeping them without a __dict__ saves memory
+    __slots__ = ("title", "author", "year", "price", "genres")
 
     def __init__(self, title: str, author: str, print_year: int, price: int, genres: list):
         self.title = title
@@ -9,7 +11,8 @@ class Book:
         self.genres = genres
 
     def get_properties(self):
-        return self.__dict__
+        return {"title": self.title, "author": self.author, "year": self.year, "price": self.price,
+                "genres": self.genres}
 
     @staticmethod
     def dict_to_book(dictionary: dict):
@@ -20,9 +23,8 @@ class Book:
 
     @staticmethod
     def is_dict_a_book(dictionary: dict):
-        dict_keys_sorted = sorted(list(dictionary.keys()))
-        books_properties_sorted = sorted(Book.books_properties)
-        return dict_keys_sorted == books_properties_sorted
+        # Dictionary keys are unique, so comparing them as sets is the same as comparing them sorted
+        return dictionary.keys() == set(Book.books_properties)
 
 
 
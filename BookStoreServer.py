@@ -1,8 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from Book import Book
+from QueryCache import QueryCache, StateBytesCache
+from BooksChangeLog import BooksChangeLog
+from QueueLogHandler import QueueLogHandler
+from RequestsMetrics import RequestsMetrics
+from RequestsProfiler import RequestsProfiler, span
+from werkzeug.serving import make_server
 import logging
+import gc
+import base64
+import csv
+import gzip
+import io
+import json
+import binascii
+import multiprocessing
+import signal
+import socket
+import tempfile
+import threading
 import time
 import os
+import zlib
+# Brotli and Zstandard compression are offered when their packages are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 class BookStoreServer:
 
@@ -10,36 +38,227 @@ class BookStoreServer:
     conflict_status_code = 409
     not_found_status_code = 404
     bad_request_status_code = 400
+    not_modified_status_code = 304
+    # Number of books fetched from the store at a time while streaming GET /books
+    stream_page_size = 1000
+    # Searches are answered a page at a time, and need queries long enough to be looked up by trigrams
+    search_page_size = 50
+    min_search_query_length = 3
+    # The catalog is snapshotted once this many bytes of changes were logged since the last snapshot,
+    # which is checked every snapshot_check_interval seconds
+    snapshot_min_log_size = 64 * 1024 * 1024
+    snapshot_check_interval = 10
+    # Content encodings of GET /books responses, in the order they are preferred in. Streamed responses
+    # are compressed on the fly, with gzip only. Smaller responses are sent as they are.
+    content_encodings = [content_encoding for content_encoding, module in
+                         (("zstd", zstandard), ("br", brotli), ("gzip", gzip)) if module is not None]
+    stream_content_encodings = ["gzip"]
+    compression_min_size = 1024
+    # Compressed GET /books responses are kept up to this many bytes in all, and only when smaller than
+    # compressed_response_max_cached_size
+    compressed_responses_cache_size = 64 * 1024 * 1024
+    compressed_response_max_cached_size = 8 * 1024 * 1024
+    # Memory a worker's copy of the catalog takes per book, and the number of books the default number of
+    # workers leaves room for when the catalog is smaller
+    memory_per_book = 1100
+    planned_num_of_books = 1000000
 
-    def __init__(self, host: str, port: int, book_store):
+    def __init__(self, host: str, port: int, book_store, query_cache_capacity: int = 256,
+                 log_queue_capacity: int = 10000, log_overflow_policy: str = "drop", data_directory: str = None,
+                 profiling_sample_rate: float = 0.0):
         self.__app = Flask(__name__)
         self.__host = host
         self.__port = port
         self.__book_store = book_store
         self.__book_store.add_website(self)
+        self.__query_cache = QueryCache(query_cache_capacity)
+        # Compressed GET /books responses made at the current state of the catalog
+        self.__compressed_responses_cache = StateBytesCache(BookStoreServer.compressed_responses_cache_size,
+                                                            BookStoreServer.compressed_response_max_cached_size)
         self.setup_routes()
+        self.__requests_metrics = RequestsMetrics([(rule.rule, method) for rule in self.__app.url_map.iter_rules()
+                                                   for method in sorted(rule.methods - {"HEAD", "OPTIONS"})])
         self.__json_response_template = {"errorMessage": "", "result": ""}
         self.__request_logger = None
         self.__books_logger = None
-        self.__current_request = None
-        self.__current_request_num = 0
+        # Log records are written by a background thread, see QueueLogHandler
+        self.__log_queue_capacity = log_queue_capacity
+        self.__log_overflow_policy = log_overflow_policy
+        # Where the change log and the snapshots of the catalog are kept, None keeps the catalog in memory only
+        self.__data_directory = data_directory
+        # Requests may be handled on many threads, and by many worker processes, at once, so the state
+        # of a request lives in flask.g and only the counter numbering the requests is shared.
+        # The counter lives in shared memory, so it keeps counting across the worker processes.
+        self.__request_counter = multiprocessing.Value("q", 0)
+        self.__worker_index_of_pid = dict()
+        self.__is_shutting_down = False
+        self.__app.before_request(self.__sync_book_store)
         self.__setup_loggers()
+        self.__setup_requests_metrics()
+        # Profiling is off until a sample rate is set or a request asks for it, see RequestsProfiler.
+        # The whole WSGI app is profiled, so the time spent in Flask and in logging shows up as well.
+        self.__requests_profiler = RequestsProfiler(profiling_sample_rate)
+        self.__app.wsgi_app = self.__requests_profiler.wrap(self.__app.wsgi_app)
 
-    def run(self):
-        self.__app.run(self.__host, self.__port)
+    def run(self, num_of_workers: int = 1):
+        # None runs as many workers as the memory left and the CPUs allow, see __get_default_num_of_workers
+        if not hasattr(os, "fork"):
+            num_of_workers = 1
+        if num_of_workers is None:
+            # The catalog is restored first, so its size is known when sizing the workers
+            change_log = self.__open_change_log(1)
+            num_of_workers = self.__get_default_num_of_workers()
+            if change_log is None and num_of_workers > 1:
+                change_log = self.__open_change_log(num_of_workers)
+        else:
+            change_log = self.__open_change_log(num_of_workers)
+        if num_of_workers <= 1:
+            if change_log is not None:
+                self.__start_snapshots(change_log)
+            self.__app.run(self.__host, self.__port)
+        else:
+            self.__run_workers(num_of_workers, change_log)
+
+    # --------------------- Persistence ---------------------
+
+    def __open_change_log(self, num_of_workers: int):
+        # With a data directory the change log is durable, and the catalog is restored from it.
+        # Without one, workers still share their changes through a change log in a temporary directory.
+        if self.__data_directory is not None:
+            change_log = BooksChangeLog(self.__data_directory, is_durable=True)
+        elif num_of_workers > 1:
+            change_log = BooksChangeLog(tempfile.mkdtemp(prefix="bookstore-"))
+        else:
+            return None
+
+        start_time = time.time()
+        # Restoring creates a lot of objects that all stay alive, so the garbage collector is paused meanwhile
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.__book_store.set_change_log(change_log)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self.__request_logger.info("Restored %s books from %s in %.3fs", self.__book_store.get_num_of_books(),
+                                   change_log.get_directory(), time.time() - start_time)
+        return change_log
+
+    def __start_snapshots(self, change_log: BooksChangeLog):
+        snapshots_thread = threading.Thread(target=self.__save_snapshots, args=(change_log,), name="snapshots", daemon=True)
+        snapshots_thread.start()
+
+    def __save_snapshots(self, change_log: BooksChangeLog):
+        # Snapshots keep the change log short, so restoring the catalog replays only a few changes
+        while True:
+            time.sleep(BookStoreServer.snapshot_check_interval)
+            if change_log.get_committed_size() - change_log.get_segment_start() < BookStoreServer.snapshot_min_log_size:
+                continue
+            try:
+                start_time = time.time()
+                self.__book_store.save_snapshot()
+                self.__request_logger.info("Saved a snapshot of the catalog in %.3fs", time.time() - start_time)
+            except OSError:
+                self.__request_logger.exception("Saving a snapshot of the catalog failed")
+
+    # --------------------- Worker Processes ---------------------
+
+    def __run_workers(self, num_of_workers: int, change_log: BooksChangeLog):
+        # Prefork mode: the listening socket is opened once, and every forked worker accepts connections
+        # on it with its own threaded server and its own copy of the catalog.
+        # Workers are replicas: every worker holds a whole copy of the catalog and its indexes, about
+        # memory_per_book bytes per book (1.1 GB per million books), kept in sync through a change log every
+        # worker appends its changes to. The pages of the catalog restored here are only shared
+        # copy-on-write, and reference counting writes to most of them, so memory grows with the number of
+        # workers.
+        listening_socket = socket.create_server((self.__host, self.__port), backlog=1024)
+        listening_socket.set_inheritable(True)
+
+        signal.signal(signal.SIGTERM, self.__stop_workers)
+        signal.signal(signal.SIGINT, self.__stop_workers)
+        for worker_index in range(num_of_workers):
+            self.__fork_worker(listening_socket, worker_index, change_log)
+        self.__request_logger.info("Serving on %s:%s with %s workers", self.__host, self.__port, num_of_workers)
+
+        # Replace workers that died, until asked to shut down
+        while len(self.__worker_index_of_pid) > 0:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            worker_index = self.__worker_index_of_pid.pop(pid, None)
+            if not self.__is_shutting_down and worker_index is not None:
+                self.__request_logger.error("Worker %s died, starting a new one", pid)
+                self.__fork_worker(listening_socket, worker_index, change_log)
+        listening_socket.close()
+
+    def __get_default_num_of_workers(self) -> int:
+        # One worker per CPU, as long as each of them has room for its own copy of the catalog, with the
+        # catalog growing to planned_num_of_books
+        num_of_books = max(self.__book_store.get_num_of_books(), BookStoreServer.planned_num_of_books)
+        available_memory = get_available_memory()
+        if available_memory is None:
+            return 1
+        num_of_workers = min(os.cpu_count() or 1, available_memory // (num_of_books * BookStoreServer.memory_per_book))
+        self.__request_logger.info("Sized %s workers to %s MB of memory available", max(num_of_workers, 1),
+                                   available_memory // (1024 * 1024))
+        return max(num_of_workers, 1)
+
+    def __fork_worker(self, listening_socket: socket.socket, worker_index: int, change_log: BooksChangeLog):
+        pid = os.fork()
+        if pid != 0:
+            self.__worker_index_of_pid[pid] = worker_index
+            return
+        try:
+            signal.signal(signal.SIGTERM, exit_on_signal)
+            signal.signal(signal.SIGINT, exit_on_signal)
+            # A single worker saves the snapshots
+            if worker_index == 0:
+                self.__start_snapshots(change_log)
+            server = make_server(self.__host, self.__port, self.__app, threaded=True, fd=listening_socket.fileno())
+            server.serve_forever()
+        finally:
+            # Write out the queued log records before the worker exits
+            logging.shutdown()
+            os._exit(1)
+
+    def __stop_workers(self, signal_number, frame):
+        self.__is_shutting_down = True
+        for pid in self.__worker_index_of_pid:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def __sync_book_store(self):
+        # Catch up with the changes other workers made to the catalog before handling the request
+        self.__book_store.sync_with_change_log()
 
     def setup_routes(self):
         app = self.__app
         app.add_url_rule("/", "index", self.__index)
         app.add_url_rule("/books/health", "health", self.__health, methods=["GET"])
         app.add_url_rule("/book", "create", self.__add_book, methods=["POST"])
+        app.add_url_rule("/books/bulk", "bulk create", self.__add_books_bulk, methods=["POST"])
+        app.add_url_rule("/books/bulk", "bulk books by id", self.__get_books_by_ids_bulk, methods=["GET"])
+        app.add_url_rule("/books/bulk", "bulk update_book price", self.__update_books_prices_bulk, methods=["PUT"])
+        app.add_url_rule("/books/bulk", "bulk delete books", self.__delete_books_by_ids_bulk, methods=["DELETE"])
         app.add_url_rule("/books/total", "books count", self.__books_count, methods=["GET"])
         app.add_url_rule("/books", "books data", self.__books_data, methods=["GET"])
+        app.add_url_rule("/books/search", "search books", self.__search_books, methods=["GET"])
+        app.add_url_rule("/books/stats", "books stats", self.__books_stats, methods=["GET"])
         app.add_url_rule("/book", "book by id", self.__get_book_by_id, methods=["GET"])
         app.add_url_rule("/book", "update_book price", self.__update_book_price, methods=["PUT"])
         app.add_url_rule("/book", "delete book", self.__delete_book_by_id, methods=["DELETE"])
         app.add_url_rule("/logs/level", "get log level", self.__get_logger_level, methods=["GET"])
         app.add_url_rule("/logs/level", "set log level", self.__set_logger_level, methods=["PUT"])
+        app.add_url_rule("/profiling", "profiling report", self.__get_profiling_report, methods=["GET"])
+        app.add_url_rule("/profiling", "set profiling sample rate", self.__set_profiling_sample_rate, methods=["PUT"])
+        app.add_url_rule("/profiling", "reset profiling report", self.__reset_profiling_report, methods=["DELETE"])
+        app.add_url_rule("/cache/stats", "cache stats", self.__get_cache_stats, methods=["GET"])
+        app.add_url_rule("/metrics", "metrics", self.__get_metrics, methods=["GET"])
 
     def __setup_loggers(self):
         # Create the logs directory if it doesn't exist
@@ -61,28 +280,27 @@ class BookStoreServer:
         formatter = logging.Formatter('%(asctime)s.%(msecs)03d %(levelname)s: %(message)s', datefmt='%d-%m-%Y %H:%M:%S')
         # Create file handler for logging to a file
         file_handler = logging.FileHandler('logs/requests.log')
-        file_handler.setLevel(default_level)
         file_handler.setFormatter(formatter)
         # Create console handler for logging to a file
         console_handler = logging.StreamHandler()
-        console_handler.setLevel(default_level)
         console_handler.setFormatter(formatter)
-        # Add handlers to the logger
-        self.__request_logger.addHandler(console_handler)
-        self.__request_logger.addHandler(file_handler)
+        # Add handlers to the logger, through the queue of the background writer
+        self.__request_logger.addHandler(self.__create_queue_log_handler([console_handler, file_handler], default_level))
         # Do the following before and after each request
         self.__app.before_request(self.__log_request)
         self.__app.after_request(self.__log_duration)
 
     def __log_request(self):
-        self.__current_request = request
-        self.__current_request_num += 1
-        self.__current_request.start_time = time.time()
-        self.__request_logger.info(f"Incoming request | #{ self.__current_request_num} | resource: { self.__current_request.path} | HTTP Verb {self.__current_request.method} | request #{self.__current_request_num}")
+        with self.__request_counter.get_lock():
+            self.__request_counter.value += 1
+            g.request_num = self.__request_counter.value
+        g.start_time = time.time()
+        self.__request_logger.info("Incoming request | #%s | resource: %s | HTTP Verb %s | request #%s",
+                                  g.request_num, request.path, request.method, g.request_num)
 
     def __log_duration(self, response):
-        duration = (time.time() - self.__current_request.start_time) * 1000  # convert to milliseconds
-        self.__request_logger.debug(f"request #{self.__current_request_num} duration: {duration:.5f}ms | request #{self.__current_request_num}")
+        duration = (time.time() - g.start_time) * 1000  # convert to milliseconds
+        self.__request_logger.debug("request #%s duration: %.5fms | request #%s", g.request_num, duration, g.request_num)
         return response
 
     def __setup_books_logger(self, default_level):
@@ -91,11 +309,16 @@ class BookStoreServer:
         self.__books_logger.setLevel(default_level)
         # Create formatter and add it to the handlers
         formatter = logging.Formatter('%(asctime)s.%(msecs)03d %(levelname)s: %(message)s', datefmt='%d-%m-%Y %H:%M:%S')
-        # Create file handler for logging to a file
-        file_handler = logging.FileHandler('logs/books.log')
-        file_handler.setLevel(default_level)
+        # Create file handler for logging to a file. Titles may hold lone surrogates, which are escaped.
+        file_handler = logging.FileHandler('logs/books.log', errors='backslashreplace')
         file_handler.setFormatter(formatter)
-        self.__books_logger.addHandler(file_handler)
+        self.__books_logger.addHandler(self.__create_queue_log_handler([file_handler], default_level))
+
+    def __create_queue_log_handler(self, target_handlers, default_level):
+        # The level is checked on the queue handler, before a record is queued
+        queue_log_handler = QueueLogHandler(target_handlers, self.__log_queue_capacity, self.__log_overflow_policy)
+        queue_log_handler.setLevel(default_level)
+        return queue_log_handler
 
     def __index(self):
         return "Hello World"
@@ -107,12 +330,12 @@ class BookStoreServer:
         new_book_dict = request.get_json()
         new_book = Book.dict_to_book(new_book_dict)
 
-        error_message = self.__book_store.add_book(new_book)
+        new_book_id, error_message = self.__book_store.add_book(new_book)
         if error_message == "":
-            result = self.__book_store.get_num_of_books() # The new ID is the number of books after the adding
+            result = new_book_id
             status = BookStoreServer.ok_status_code
             self.__log_info_add_book(new_book.title)
-            self.__log_debug_add_book()
+            self.__log_debug_add_book(new_book_id)
         else:
             result = ""
             status = BookStoreServer.conflict_status_code
@@ -121,12 +344,173 @@ class BookStoreServer:
         response_json = self.__generate_json_response(result, error_message)
         return jsonify(response_json), status
 
+    def __add_books_bulk(self):
+        # Creates all the books in the request body in one change to the store.
+        # The body is a JSON array of books, NDJSON (one book per line) or CSV with a header row.
+        # Every book gets its own result: the new book's id, or the reason it wasn't created.
+        # A batch allocates millions of objects without reference cycles, so collecting garbage while
+        # it is being read and added would only rescan the growing catalog again and again
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            books_dicts, error_message = self.__get_bulk_books_dicts()
+            if error_message != "":
+                self.__books_logger.error(error_message)
+                return self.__generate_json_response("", error_message), BookStoreServer.bad_request_status_code
+
+            are_books = [is_bulk_item_a_book(book_dict) for book_dict in books_dicts]
+            new_books = [Book.dict_to_book(book_dict) for book_dict, is_book in zip(books_dicts, are_books) if is_book]
+            added_books_results = iter(self.__book_store.add_books(new_books))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        result = []
+        num_of_books_added = 0
+        for is_book in are_books:
+            if is_book:
+                new_book_id, book_error_message = next(added_books_results)
+            else:
+                new_book_id = None
+                book_error_message = ("Error: A book must have exactly the properties title, author, price, year "
+                                      "and genres, with a string title and author, numeric price and year, "
+                                      "and a list of strings as genres")
+            if new_book_id is None:
+                self.__books_logger.error(book_error_message)
+                result.append(self.__generate_json_response("", book_error_message))
+            else:
+                num_of_books_added += 1
+                result.append(self.__generate_json_response(new_book_id, ""))
+
+        self.__log_info_add_books_bulk(num_of_books_added, len(books_dicts))
+        return jsonify(self.__generate_json_response(result, "")), BookStoreServer.ok_status_code
+
+    def __get_bulk_books_dicts(self):
+        body = request.get_data(as_text=True)
+        try:
+            if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+                books_dicts = [json.loads(line) for line in body.splitlines() if line.strip() != ""]
+            elif request.mimetype == "text/csv":
+                books_dicts = [csv_row_to_book_dict(row) for row in csv.DictReader(io.StringIO(body))]
+            else:
+                books_dicts = json.loads(body)
+        except ValueError:
+            return None, "Error: bulk request body must be a JSON array, NDJSON or CSV of books"
+
+        if not isinstance(books_dicts, list):
+            return None, "Error: bulk request body must be a JSON array, NDJSON or CSV of books"
+        return books_dicts, ""
+
+    def __get_books_by_ids_bulk(self):
+        # Fetches many books in one store call. The ids are given like in __get_bulk_ids.
+        # Every id gets its own result: the book, or the reason it wasn't found.
+        ids, error_message = self.__get_bulk_ids()
+        if error_message != "":
+            self.__books_logger.error(error_message)
+            return self.__generate_json_response("", error_message), BookStoreServer.bad_request_status_code
+
+        result = []
+        for id, (encoded_book, book_was_found) in zip(ids, self.__book_store.get_books_by_ids(ids, as_json=True)):
+            if book_was_found:
+                result.append(self.__generate_json_response(encoded_book, ""))
+            else:
+                book_error_message = f"Error: no such Book with id {id}"
+                self.__books_logger.error(book_error_message)
+                result.append(self.__generate_json_response("", book_error_message))
+
+        self.__books_logger.debug("Fetching %s books details in bulk | request #%s", len(ids), g.request_num)
+        return self.__encoded_json_response(self.__generate_json_response(result, "")), BookStoreServer.ok_status_code
+
+    def __update_books_prices_bulk(self):
+        # Updates many prices in a single change to the store. The body is a JSON object of book id -> new price.
+        # Every book gets its own result, like PUT /book: its old price, or the reason it wasn't updated.
+        body_error_message = "Error: bulk price update body must be a JSON object of book ids to prices"
+        try:
+            new_price_of_id = json.loads(request.get_data(as_text=True))
+            if not isinstance(new_price_of_id, dict):
+                raise ValueError(body_error_message)
+            ids = [int(id) for id in new_price_of_id.keys()]
+        except ValueError:
+            self.__books_logger.error(body_error_message)
+            return self.__generate_json_response("", body_error_message), BookStoreServer.bad_request_status_code
+
+        # Prices that are not integers are rejected like non-positive ones
+        new_prices = [(id, new_price if is_integer(new_price) else None)
+                      for id, new_price in zip(ids, new_price_of_id.values())]
+        result = []
+        num_of_books_updated = 0
+        for (id, new_price), (old_book, price_was_updated) in zip(new_prices, self.__book_store.update_books_prices(new_prices)):
+            if old_book == {}:
+                book_error_message = f"Error: no such Book with id {id}"
+            elif not price_was_updated:
+                book_error_message = f"Error: price update for book [{id}] must be a positive integer"
+            else:
+                num_of_books_updated += 1
+                result.append(self.__generate_json_response(old_book["price"], ""))
+                self.__log_debug_update_book_price(old_book["title"], old_book["price"], new_price)
+                continue
+            self.__books_logger.error(book_error_message)
+            result.append(self.__generate_json_response("", book_error_message))
+
+        self.__books_logger.info("Updating the prices of %s Books out of %s in bulk | request #%s",
+                                 num_of_books_updated, len(new_prices), g.request_num)
+        return jsonify(self.__generate_json_response(result, "")), BookStoreServer.ok_status_code
+
+    def __delete_books_by_ids_bulk(self):
+        # Removes many books in a single change to the store. The ids are given like in __get_bulk_ids.
+        # Every id gets its own result, like DELETE /book: the number of books left after its book
+        # was removed, or the reason it wasn't removed.
+        ids, error_message = self.__get_bulk_ids()
+        if error_message != "":
+            self.__books_logger.error(error_message)
+            return self.__generate_json_response("", error_message), BookStoreServer.bad_request_status_code
+
+        removed_books_results = self.__book_store.remove_books_by_ids(ids)
+        num_of_books_removed = sum(book_was_removed for _, book_was_removed, _ in removed_books_results)
+        result = []
+        for id, (removed_book, book_was_removed, num_of_books_left) in zip(ids, removed_books_results):
+            if book_was_removed:
+                result.append(self.__generate_json_response(num_of_books_left, ""))
+                if self.__books_logger.isEnabledFor(logging.DEBUG):
+                    self.__log_debug_delete_book(removed_book["title"], id, num_of_books_left)
+            else:
+                book_error_message = f"Error: no such Book with id {id}"
+                self.__books_logger.error(book_error_message)
+                result.append(self.__generate_json_response("", book_error_message))
+
+        self.__books_logger.info("Removing %s Books out of %s in bulk | request #%s",
+                                 num_of_books_removed, len(ids), g.request_num)
+        return jsonify(self.__generate_json_response(result, "")), BookStoreServer.ok_status_code
+
+    def __get_bulk_ids(self):
+        # The ids are given in the ids query parameter separated by commas, or as a JSON array in the body.
+        # Returns the ids and an error message.
+        error_message = "Error: ids must be a comma separated ids query parameter or a JSON array of ids"
+        try:
+            ids = request.args.get("ids")
+            if ids is not None:
+                ids = [int(id) for id in ids.replace(" ", "").split(",")]
+            else:
+                ids = json.loads(request.get_data(as_text=True))
+        except ValueError:
+            return None, error_message
+
+        if not isinstance(ids, list) or not all(is_integer(id) for id in ids):
+            return None, error_message
+        return ids, ""
+
+    def __log_info_add_books_bulk(self, num_of_books_added, num_of_books_requested):
+        self.__books_logger.info("Creating %s new Books out of %s in bulk | request #%s",
+                                num_of_books_added, num_of_books_requested, g.request_num)
+
     def __log_info_add_book(self, new_book_title):
-        self.__books_logger.info(f"Creating new Book with Title [{new_book_title}] | request #{self.__current_request_num}")
+        self.__books_logger.info("Creating new Book with Title [%s] | request #%s", new_book_title, g.request_num)
 
-    def __log_debug_add_book(self):
+    def __log_debug_add_book(self, new_book_id):
+        if not self.__books_logger.isEnabledFor(logging.DEBUG):
+            return
         num_of_books_after_adding = self.__book_store.get_num_of_books()
-        self.__books_logger.debug(f"Currently there are {num_of_books_after_adding-1} Books in the system. New Book will be assigned with id {num_of_books_after_adding} | request #{self.__current_request_num}")
+        self.__books_logger.debug("Currently there are %s Books in the system. New Book will be assigned with id %s | request #%s",
+                                  num_of_books_after_adding - 1, new_book_id, g.request_num)
 
     def __get_filter_requests(self):
         author = request.args.get('author')
@@ -150,66 +534,245 @@ class BookStoreServer:
         return (author, price_bigger_than, price_less_than
                 , year_bigger_than, year_less_than, genres)
 
+    def __get_cached_query(self, query_name, filters, run_query):
+        # Serves a query from the cache while the store hasn't changed since it was computed
+        version = self.__book_store.get_version()
+        cache_key = (query_name, normalize_filters(filters))
+        result, is_cached = self.__query_cache.get(cache_key, version)
+        if not is_cached:
+            result = run_query()
+            self.__query_cache.put(cache_key, version, result)
+        return result
+
     def __books_count(self):
         filters = self.__get_filter_requests()
         genres = filters[5]
 
         if genres is None or is_sublist(main_list=self.__book_store.get_genres(), sub_list=genres):
-            books_df = self.__book_store.get_books(*filters)
-            result = len(books_df)
-            status = BookStoreServer.ok_status_code
+            etag = self.__get_catalog_etag()
+            matching_etag = self.__find_matching_etag(etag)
+            if matching_etag is not None:
+                return self.__not_modified_response(matching_etag)
+            result = self.__get_cached_query("books count", filters, lambda: self.__book_store.count_books(*filters))
             self.__log_info_books_data(result)
-        else:
-            result = ""
-            status = BookStoreServer.bad_request_status_code
+            response = self.__app.json.response(self.__generate_json_response(result, ""))
+            response.set_etag(etag)
+            return response
 
-        return self.__generate_json_response(result, ""), status
+        return self.__generate_json_response("", ""), BookStoreServer.bad_request_status_code
+
+    def __books_stats(self):
+        # Counts of the books per genre, publication year and price bucket, and their lowest, highest and
+        # mean price, for the books matching the same filters as GET /books/total
+        filters = self.__get_filter_requests()
+        genres = filters[5]
+
+        if genres is None or is_sublist(main_list=self.__book_store.get_genres(), sub_list=genres):
+            etag = self.__get_catalog_etag()
+            matching_etag = self.__find_matching_etag(etag)
+            if matching_etag is not None:
+                return self.__not_modified_response(matching_etag)
+            result = self.__get_cached_query("books stats", filters, lambda: self.__book_store.get_books_stats(*filters))
+            self.__log_info_books_data(result["total"])
+            response = self.__app.json.response(self.__generate_json_response(result, ""))
+            response.set_etag(etag)
+            return response
+
+        return self.__generate_json_response("", ""), BookStoreServer.bad_request_status_code
 
     def __books_data(self):
         filters = self.__get_filter_requests()
         genres = filters[5]
+        error_message = ""
 
         if genres is None or is_sublist(main_list=self.__book_store.get_genres(), sub_list=genres):
-            filtered_books_df = self.__book_store.get_books(*filters)
-            # Convert 'title' column to lowercase for case-insensitive sorting
-            filtered_books_df['title_lower'] = filtered_books_df['title'].str.lower()
-            filtered_books_df = filtered_books_df.sort_values(by='title_lower')
-            # Drop the temporary lowercase title column
-            filtered_books_df.drop(columns=['title_lower'], inplace=True)
-            result = list(filtered_books_df.apply(lambda row: row.to_dict(), axis=1))
-            status = BookStoreServer.ok_status_code
-            self.__log_info_books_data(len(result))
+            (after_title, offset, limit, stream), error_message = self.__get_paging_requests()
+            if error_message != "":
+                result = ""
+                status = BookStoreServer.bad_request_status_code
+                self.__books_logger.error(error_message)
+            elif stream:
+                return self.__stream_books_data(filters, after_title, offset, limit)
+            else:
+                return self.__books_data_response(filters, after_title, offset, limit)
         else:
             result = ""
             status = BookStoreServer.bad_request_status_code
 
-        response_json = self.__generate_json_response(result, "")
+        response_json = self.__generate_json_response(result, error_message)
         return response_json, status
 
-    def __log_info_books_data(self, total_books_found):
-        self.__books_logger.info(f"Total Books found for requested filters is {total_books_found} | request #{self.__current_request_num}")
+    def __get_paging_requests(self):
+        # Returns (lowercase title to start after, offset, limit, stream) and an error message
+        paging = (None, 0, None, False)
+        limits_error_message = "Error: limit must be a positive integer and offset a non-negative integer"
+        try:
+            limit = request.args.get("limit")
+            if limit is not None:
+                limit = int(limit)
+            offset = int(request.args.get("offset", 0))
+        except ValueError:
+            return paging, limits_error_message
+        try:
+            cursor = request.args.get("cursor")
+            after_title = decode_cursor(cursor) if cursor is not None else None
+        except ValueError:
+            return paging, "Error: cursor must be taken from the nextCursor of a previous response"
+
+        stream = request.args.get("stream", "false").lower() == "true"
+        if (limit is not None and limit <= 0) or offset < 0:
+            return paging, limits_error_message
+        return (after_title, offset, limit, stream), ""
+
+    def __books_data_response(self, filters, after_title, offset, limit):
+        # All the requested books, or a page of them, tagged with the state of the catalog.
+        # Large responses are compressed when the client accepts it, and the compressed response is
+        # kept until the catalog changes, so repeated requests neither query nor compress again.
+        etag = self.__get_catalog_etag()
+        matching_etag = self.__find_matching_etag(etag)
+        if matching_etag is not None:
+            return self.__not_modified_response(matching_etag)
+
+        state_position = self.__book_store.get_state_position()
+        content_encoding = request.accept_encodings.best_match(BookStoreServer.content_encodings)
+        cache_key = ("books data", normalize_filters(filters), after_title, offset, limit, content_encoding)
+        if content_encoding is not None:
+            cached_response = self.__compressed_responses_cache.get(cache_key, state_position)
+            if cached_response is not None:
+                compressed_body, num_of_books = cached_response
+                self.__log_info_books_data(num_of_books)
+                return self.__compressed_response(compressed_body, content_encoding, etag)
+
+        if after_title is not None or offset != 0 or limit is not None:
+            response_json = self.__books_data_page(filters, after_title, offset, limit)
+        else:
+            result = self.__get_cached_query("books data", filters,
+                                             lambda: self.__book_store.get_sorted_books(*filters, as_json=True))
+            response_json = self.__generate_json_response(result, "")
+        num_of_books = len(response_json["result"])
+        self.__log_info_books_data(num_of_books)
+
+        response = self.__encoded_json_response(response_json)
+        if content_encoding is not None and response.content_length >= BookStoreServer.compression_min_size:
+            with span("response: compress"):
+                compressed_body = compress(response.get_data(), content_encoding)
+            self.__compressed_responses_cache.put(cache_key, state_position, compressed_body, num_of_books)
+            return self.__compressed_response(compressed_body, content_encoding, etag)
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def __books_data_page(self, filters, after_title, offset, limit):
+        return self.__books_page(lambda page_limit: self.__book_store.get_sorted_books(
+            *filters, after_title=after_title, offset=offset, limit=page_limit, as_json=True), limit)
+
+    def __books_page(self, get_sorted_books, limit):
+        # get_sorted_books(limit) returns the JSON encoded books of the page. One book more than requested
+        # is fetched to know whether there is a next page.
+        page_limit = None if limit is None else limit + 1
+        page = get_sorted_books(page_limit)
+        next_cursor = None
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(json.loads(page[-1])["title"].lower())
+
+        response_json = self.__generate_json_response(page, "")
+        response_json["nextCursor"] = next_cursor
+        return response_json
+
+    def __search_books(self):
+        # Books whose title or author contains the q query parameter, case-insensitively, ordered by title.
+        # Pages are requested like in GET /books, search_page_size books at a time by default.
+        query = request.args.get("q", "")
+        (after_title, offset, limit, _), error_message = self.__get_paging_requests()
+        if error_message == "" and len(query) < BookStoreServer.min_search_query_length:
+            error_message = f"Error: search query q must be at least {BookStoreServer.min_search_query_length} characters long"
+        if error_message != "":
+            self.__books_logger.error(error_message)
+            return self.__generate_json_response("", error_message), BookStoreServer.bad_request_status_code
+
+        etag = self.__get_catalog_etag()
+        matching_etag = self.__find_matching_etag(etag)
+        if matching_etag is not None:
+            return self.__not_modified_response(matching_etag)
+        if limit is None:
+            limit = BookStoreServer.search_page_size
+        response_json = self.__books_page(lambda page_limit: self.__book_store.search_books(
+            query, after_title=after_title, offset=offset, limit=page_limit, as_json=True), limit)
+        self.__books_logger.info("Total Books found for search [%s] is %s | request #%s",
+                                 query, len(response_json["result"]), g.request_num)
+        response = self.__encoded_json_response(response_json)
+        response.set_etag(etag)
+        return response
+
+    def __stream_books_data(self, filters, after_title, offset, limit):
+        # Writes the JSON response while the books are fetched from the store page by page. The matching
+        # books are found and ordered once, and only their ids are held, so no more than one page of
+        # books is held in memory no matter how many books match.
+        # The pages are read at different states of the catalog, where books removed since the stream
+        # started are left out, so the response has no ETag.
+        request_num = g.request_num
+        content_encoding = request.accept_encodings.best_match(BookStoreServer.stream_content_encodings)
+
+        def generate_books_json():
+            yield b'{"errorMessage":"","result":['
+            ids = self.__book_store.get_sorted_books_ids(*filters, after_title=after_title, offset=offset, limit=limit)
+            num_of_books_sent = 0
+            for page_start in range(0, len(ids), BookStoreServer.stream_page_size):
+                page_ids = ids[page_start:page_start + BookStoreServer.stream_page_size].tolist()
+                page = [encoded_book for encoded_book, book_was_found
+                        in self.__book_store.get_books_by_ids(page_ids, as_json=True) if book_was_found]
+                if len(page) > 0:
+                    yield (b"," if num_of_books_sent > 0 else b"") + b",".join(page)
+                    num_of_books_sent += len(page)
+            yield b']}\n'
+            self.__log_info_books_data(num_of_books_sent, request_num)
+
+        if content_encoding is None:
+            return Response(generate_books_json(), status=BookStoreServer.ok_status_code, mimetype="application/json")
+        response = Response(gzip_chunks(generate_books_json()), status=BookStoreServer.ok_status_code,
+                            mimetype="application/json")
+        response.headers["Content-Encoding"] = content_encoding
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def __log_info_books_data(self, total_books_found, request_num=None):
+        if request_num is None:
+            request_num = g.request_num
+        self.__books_logger.info("Total Books found for requested filters is %s | request #%s", total_books_found, request_num)
 
     def __get_book_by_id(self):
         id = int(request.args.get("id"))
-        result, book_was_found = self.__book_store.get_book_by_id(id, as_dict=True)
-        if book_was_found:
-            error_message = ""
-            status = BookStoreServer.ok_status_code
+        encoded_book, book_version = self.__book_store.get_encoded_book(id)
+        if encoded_book is not None:
             self.__log_debug_get_book_by_id(id)
+            # The book is tagged with its own version, so changes to other books keep it cached
+            etag = f"{self.__book_store.get_store_id()}-{book_version}"
+            matching_etag = self.__find_matching_etag(etag)
+            if matching_etag is not None:
+                return self.__not_modified_response(matching_etag)
+            response = self.__encoded_json_response(self.__generate_json_response(encoded_book, ""))
+            response.set_etag(etag)
+            return response
         else:
             error_message = f"Error: no such Book with id {id}"
             status = BookStoreServer.not_found_status_code
             self.__books_logger.error(error_message)
 
-        return self.__generate_json_response(result, error_message), status
+        return self.__generate_json_response({}, error_message), status
 
     def __log_debug_get_book_by_id(self, id):
-        self.__books_logger.debug(f"Fetching book id {id} details | request #{self.__current_request_num}")
+        self.__books_logger.debug("Fetching book id %s details | request #%s", id, g.request_num)
 
     def __update_book_price(self):
         id = int(request.args.get("id"))
         new_price = int(request.args.get("price"))
-        book_series, book_was_found = self.__book_store.get_book_by_id(id, as_dict=False)
+        # Finding the book and updating its price is one store operation, so no other request
+        # can change or remove the book in between
+        if new_price > 0:
+            old_book, book_was_found = self.__book_store.update_book_price(id, new_price)
+        else:
+            old_book, book_was_found = self.__book_store.get_book_by_id(id, as_dict=True)
 
         if book_was_found == False:
             result = ""
@@ -222,33 +785,33 @@ class BookStoreServer:
             status = BookStoreServer.conflict_status_code
             self.__books_logger.error(error_message)
         else:
-            old_price = book_series["price"]
+            old_price = old_book["price"]
             result = old_price
-            self.__book_store.update_book_price(id, new_price)
             error_message = ""
             status = BookStoreServer.ok_status_code
             self.__log_info_update_book_price(id, new_price)
-            self.__log_debug_update_book_price(book_series["title"], old_price, new_price)
+            self.__log_debug_update_book_price(old_book["title"], old_price, new_price)
 
         return self.__generate_json_response(result, error_message), status
 
     def __log_info_update_book_price(self, id, new_price):
-        self.__books_logger.info(f"Update Book id [{id}] price to {new_price} | request #{self.__current_request_num}")
+        self.__books_logger.info("Update Book id [%s] price to %s | request #%s", id, new_price, g.request_num)
 
     def __log_debug_update_book_price(self, book_title, old_price, new_price):
-        self.__books_logger.debug(f"Book [{book_title}] price change: {old_price} --> {new_price} | request #{self.__current_request_num}")
+        self.__books_logger.debug("Book [%s] price change: %s --> %s | request #%s", book_title, old_price, new_price, g.request_num)
 
     def __delete_book_by_id(self):
         id = int(request.args.get("id"))
 
-        if self.__book_store.is_book_id_in_store(id):
-            removed_book_title = self.__book_store.get_book_by_id(id)[0]["title"]
-            self.__book_store.remove_book_by_id(id)
-            result = self.__book_store.get_num_of_books()
+        removed_book, book_was_removed, num_of_books_left = self.__book_store.remove_book_by_id(id)
+        if book_was_removed:
+            removed_book_title = removed_book["title"]
+            result = num_of_books_left
             error_message = ""
             status = BookStoreServer.ok_status_code
             self.__log_info_delete_book(removed_book_title)
-            self.__log_debug_delete_book(removed_book_title, id, self.__book_store.get_num_of_books())
+            if self.__books_logger.isEnabledFor(logging.DEBUG):
+                self.__log_debug_delete_book(removed_book_title, id, result)
         else:
             result = ""
             error_message = f"Error: no such Book with id {id}"
@@ -258,19 +821,23 @@ class BookStoreServer:
         return self.__generate_json_response(result, error_message), status
 
     def __log_info_delete_book(self, book_title):
-        self.__books_logger.info(
-            f"Removing book [{book_title}] | request #{self.__current_request_num}")
+        self.__books_logger.info("Removing book [%s] | request #%s", book_title, g.request_num)
 
     def __log_debug_delete_book(self, book_title, book_id, remaining_books):
-        self.__books_logger.debug(
-            f"After removing book [{book_title}] id: [{book_id}] there are {remaining_books} books in the system | request #{self.__current_request_num}")
+        self.__books_logger.debug("After removing book [%s] id: [%s] there are %s books in the system | request #%s",
+                                  book_title, book_id, remaining_books, g.request_num)
 
     def __generate_json_response(self, result, error_message):
-        response_json = self.__json_response_template
+        response_json = dict(self.__json_response_template)
         response_json["result"] = result
         response_json["errorMessage"] = error_message
         return response_json
 
+    def __encoded_json_response(self, response_json: dict) -> Response:
+        # Like the app's JSON responses, for response JSONs holding values that are already encoded
+        with span("response: encode json"):
+            return Response(encode_json(response_json) + b"\n", mimetype=self.__app.json.mimetype)
+
     def __get_logger_level(self):
         logger_name = str(request.args.get("logger-name"))
         if logger_name == "request-logger":
@@ -308,10 +875,255 @@ class BookStoreServer:
     def __get_logging_level_constant(self, level_str):
         return getattr(logging, level_str.upper(), None)
 
+    def __get_cache_stats(self):
+        return self.__generate_json_response(self.__query_cache.get_stats(), "")
+
+    # --------------------- Profiling ---------------------
+
+    def __get_profiling_report(self):
+        # Where the requests profiled by the answering worker spent their time: the functions first by
+        # sort-by (own-time, total-time or calls), and the spans timed in the store and in the responses
+        sort_by = request.args.get("sort-by", "own-time")
+        try:
+            limit = int(request.args.get("limit", 30))
+        except ValueError:
+            limit = -1
+        if sort_by not in RequestsProfiler.sort_keys or limit <= 0:
+            error_message = (f"Error: sort-by must be one of {', '.join(RequestsProfiler.sort_keys)} "
+                             f"and limit a positive integer")
+            return self.__generate_json_response("", error_message), BookStoreServer.bad_request_status_code
+        report = self.__requests_profiler.get_report(sort_by, limit)
+        report["worker"] = os.getpid()
+        return self.__generate_json_response(report, "")
+
+    def __set_profiling_sample_rate(self):
+        # Sets the share of the requests profiled by all the workers, 0 turns sampling off. Requests sent
+        # with the X-Profile-Request: true header are profiled whatever the sample rate is.
+        try:
+            self.__requests_profiler.set_sample_rate(float(request.args.get("sample-rate")))
+        except (TypeError, ValueError):
+            error_message = "Error: sample-rate must be a number between 0 and 1"
+            return self.__generate_json_response("", error_message), BookStoreServer.bad_request_status_code
+        return self.__generate_json_response(self.__requests_profiler.get_sample_rate(), "")
+
+    def __reset_profiling_report(self):
+        self.__requests_profiler.reset()
+        return self.__generate_json_response("", "")
+
+    # --------------------- Conditional Requests ---------------------
+
+    def __get_catalog_etag(self) -> str:
+        # Strong ETag of the responses computed from the whole catalog. It is taken before the response is
+        # computed, so the response may only be newer than its ETag and a stale response is never confirmed.
+        return f"{self.__book_store.get_store_id()}-{self.__book_store.get_state_position()}"
+
+    def __find_matching_etag(self, etag: str):
+        # Returns the ETag of If-None-Match naming the same version as the given ETag, in whichever
+        # content encoding the client holds it, or None when the client has to get the response again
+        if_none_match = request.if_none_match
+        if if_none_match.star_tag:
+            return etag
+        for client_etag in if_none_match.as_set(include_weak=True):
+            if remove_content_encoding(client_etag) == etag:
+                return client_etag
+        return None
+
+    def __not_modified_response(self, etag: str) -> Response:
+        response = Response(status=BookStoreServer.not_modified_status_code)
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def __compressed_response(self, compressed_body: bytes, content_encoding: str, etag: str) -> Response:
+        # Every encoding of a response is a representation of its own, with an ETag of its own
+        response = Response(compressed_body, status=BookStoreServer.ok_status_code, mimetype="application/json")
+        response.headers["Content-Encoding"] = content_encoding
+        response.set_etag(f"{etag}-{content_encoding}")
+        response.vary.add("Accept-Encoding")
+        return response
+
+    # --------------------- Metrics ---------------------
+
+    def __setup_requests_metrics(self):
+        self.__app.before_request(self.__start_request_metrics)
+        self.__app.after_request(self.__record_request_metrics)
+        self.__app.teardown_request(self.__end_request_metrics)
+
+    def __start_request_metrics(self):
+        route = request.url_rule.rule if request.url_rule is not None else None
+        g.metrics_endpoint = self.__requests_metrics.get_endpoint(route, request.method)
+        g.metrics_start_time = time.perf_counter()
+        self.__requests_metrics.start_request(g.metrics_endpoint)
+
+    def __record_request_metrics(self, response):
+        if "metrics_endpoint" in g:
+            duration = time.perf_counter() - g.metrics_start_time
+            self.__requests_metrics.observe(g.metrics_endpoint, response.status_code, duration)
+        return response
+
+    def __end_request_metrics(self, error):
+        if "metrics_endpoint" in g:
+            self.__requests_metrics.end_request(g.metrics_endpoint)
+
+    def __get_metrics(self):
+        # Metrics in the Prometheus text format. Request metrics are shared by all the workers, the
+        # query cache and the log queue belong to the worker answering.
+        prefix = "bookstore"
+        lines = self.__requests_metrics.to_prometheus_lines(f"{prefix}_http")
+        lines += [f"# HELP {prefix}_books Books in the store.",
+                  f"# TYPE {prefix}_books gauge",
+                  f"{prefix}_books {self.__book_store.get_num_of_books()}",
+                  f"# HELP {prefix}_store_version Changes made to the store.",
+                  f"# TYPE {prefix}_store_version gauge",
+                  f"{prefix}_store_version {self.__book_store.get_version()}",
+                  f"# HELP {prefix}_index_entries Keys in the sorted indexes, distinct values in the inverted indexes, trigrams in the search index.",
+                  f"# TYPE {prefix}_index_entries gauge"]
+        for index_name, index_size in self.__book_store.get_indexes_sizes().items():
+            lines.append(f'{prefix}_index_entries{{index="{index_name}"}} {index_size}')
+
+        cache_stats = self.__query_cache.get_stats()
+        for stat_name, metric_name, metric_type, description in [
+                ("hits", "query_cache_hits_total", "counter", "Query cache lookups that found a result."),
+                ("misses", "query_cache_misses_total", "counter", "Query cache lookups that found no result."),
+                ("evictions", "query_cache_evictions_total", "counter", "Results evicted from the query cache."),
+                ("hitRate", "query_cache_hit_ratio", "gauge", "Share of query cache lookups that found a result."),
+                ("size", "query_cache_entries", "gauge", "Results in the query cache.")]:
+            lines += [f"# HELP {prefix}_{metric_name} {description}",
+                      f"# TYPE {prefix}_{metric_name} {metric_type}",
+                      f"{prefix}_{metric_name} {cache_stats[stat_name]}"]
+
+        num_of_dropped_records = sum(handler.get_num_of_dropped_records()
+                                     for logger in (self.__request_logger, self.__books_logger)
+                                     for handler in logger.handlers if isinstance(handler, QueueLogHandler))
+        lines += [f"# HELP {prefix}_log_records_dropped_total Log records dropped because the log queue was full.",
+                  f"# TYPE {prefix}_log_records_dropped_total counter",
+                  f"{prefix}_log_records_dropped_total {num_of_dropped_records}"]
+        return Response("\n".join(lines) + "\n", status=BookStoreServer.ok_status_code,
+                        mimetype="text/plain; version=0.0.4")
+
+
+def exit_on_signal(signal_number, frame):
+    # Lets a worker process unwind and write out its logs when it is asked to stop
+    raise SystemExit(0)
+
+
+def get_available_memory():
+    # Bytes of memory available to new processes: what the system has available, within what is left
+    # of the container's limit when there is one. None when neither can be read.
+    available_memory = []
+    try:
+        with open("/proc/meminfo") as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith("MemAvailable:"):
+                    available_memory.append(int(line.split()[1]) * 1024)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/memory.max") as limit_file, open("/sys/fs/cgroup/memory.current") as usage_file:
+            limit = limit_file.read().strip()
+            if limit != "max":
+                available_memory.append(int(limit) - int(usage_file.read()))
+    except (OSError, ValueError):
+        pass
+    return min(available_memory) if len(available_memory) > 0 else None
+
 
 def is_sublist(main_list: list, sub_list: list) -> bool:
     for element in sub_list:
         if element not in main_list:
             return False
     else:
-        return True
\ No newline at end of file
+        return True
+
+
+def normalize_filters(filters: tuple) -> tuple:
+    # Filters that always select the same books get the same cache key:
+    # the author is compared case-insensitively and the order of the genres doesn't matter
+    author, price_bigger_than, price_less_than, year_bigger_than, year_less_than, genres = filters
+    if author is not None:
+        author = author.lower()
+    if genres is not None:
+        genres = tuple(sorted(set(genres)))
+    return (author, price_bigger_than, price_less_than
+            , year_bigger_than, year_less_than, genres)
+
+
+def compress(body: bytes, content_encoding: str) -> bytes:
+    if content_encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    if content_encoding == "br":
+        return brotli.compress(body, quality=5)
+    # A zero modification time keeps the compressed bytes the same for the same response
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def gzip_chunks(chunks):
+    # Compresses a stream of byte chunks into a gzip stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    yield compressor.flush()
+
+
+def encode_json(value) -> bytes:
+    # Encodes the value like the app's JSON provider does, compact with sorted keys, except that bytes
+    # are values already encoded that are copied as they are
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, dict):
+        return b"{" + b",".join(json.dumps(key).encode("ascii") + b":" + encode_json(value[key])
+                                for key in sorted(value)) + b"}"
+    if isinstance(value, list):
+        return b"[" + b",".join(map(encode_json, value)) + b"]"
+    return json.dumps(value).encode("ascii")
+
+
+def remove_content_encoding(etag: str) -> str:
+    # ETags of compressed responses are the ETag of the response followed by its content encoding
+    for content_encoding in ("zstd", "br", "gzip"):
+        if etag.endswith(f"-{content_encoding}"):
+            return etag[:-len(content_encoding) - 1]
+    return etag
+
+
+def encode_cursor(title: str) -> str:
+    # Cursors are opaque to clients, they hold the lowercase title the page ended at
+    return base64.urlsafe_b64encode(title.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeError) as error:
+        raise ValueError("invalid cursor") from error
+
+
+def is_bulk_item_a_book(item) -> bool:
+    # Bulk items are checked up front, so one malformed book can't fail the rest of the batch
+    if not isinstance(item, dict) or not Book.is_dict_a_book(item):
+        return False
+    return (is_number(item["price"]) and is_number(item["year"])
+            and isinstance(item["title"], str) and isinstance(item["author"], str)
+            and isinstance(item["genres"], list) and all(isinstance(genre, str) for genre in item["genres"]))
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_integer(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def csv_row_to_book_dict(row: dict):
+    # CSV books hold their genres as one comma separated field, like the genres query parameter
+    book_dict = dict(row)
+    try:
+        book_dict["price"] = int(book_dict["price"])
+        book_dict["year"] = int(book_dict["year"])
+        book_dict["genres"] = book_dict["genres"].replace(" ", "").split(",")
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    return book_dict
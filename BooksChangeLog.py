@@ -0,0 +1,191 @@
+import json
+import multiprocessing
+import os
+import re
+from contextlib import contextmanager
+
+
+class BooksChangeLog:
+    # Append-only log of the changes made to the catalog, kept in a directory and shared by processes
+    # forked after it was opened.
+    # Every process keeps its own copy of the catalog. A process that changes the catalog first takes the
+    # writer lock, so there is a single writer at a time, and appends the change to the log.
+    # The other processes notice the log grew and replay the new changes on their own copy.
+    # Changes are written as one JSON line each, and are addressed by their offset in the whole log.
+    # The log is split into segment files named after the offset they start at, so the segments that
+    # are covered by a snapshot can be removed.
+    # A durable log flushes changes to disk before they are acknowledged, with group commit: a single
+    # flush covers every change appended until it starts.
+
+    segment_file_pattern = re.compile(r"^changes-(\d+)\.log$")
+
+    def __init__(self, directory: str, is_durable: bool = False):
+        self.__directory = directory
+        self.__is_durable = is_durable
+        self.__writer_lock = multiprocessing.Lock()
+        self.__flush_lock = multiprocessing.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments_starts = self.__get_segments_starts()
+        if len(segments_starts) == 0:
+            segments_starts = [0]
+            open(self.__get_segment_path(0), "ab").close()
+        self.__first_offset = segments_starts[0]
+        last_segment_start = segments_starts[-1]
+        last_segment_size = self.__drop_partial_change(self.__get_segment_path(last_segment_start))
+        # Offsets shared by all the processes: where the segment written to starts, how much of the log
+        # holds complete changes, and how much of it is known to be on disk
+        self.__segment_start = multiprocessing.Value("q", last_segment_start, lock=False)
+        self.__committed_size = multiprocessing.Value("q", last_segment_start + last_segment_size, lock=False)
+        self.__durable_size = multiprocessing.Value("q", self.__committed_size.value, lock=False)
+        # Every process opens the segments for itself, so no file offsets are shared across a fork
+        self.__file_descriptors = dict()
+        self.__file_descriptors_pid = None
+
+    @contextmanager
+    def writer_locked(self):
+        with self.__writer_lock:
+            yield
+
+    # --------------------- State Changers ---------------------
+
+    def append(self, change: dict):
+        # Must be called while holding the writer lock. The change only counts as appended once it was
+        # written whole, a write that fails raises and leaves the committed size as it was.
+        change_line = (json.dumps(change, separators=(",", ":")) + "\n").encode("utf-8")
+        file_descriptor = self.__get_file_descriptor(self.__segment_start.value)
+        segment_size = self.__committed_size.value - self.__segment_start.value
+        if os.fstat(file_descriptor).st_size != segment_size:
+            # A write that failed before, for instance on a full disk, left part of its change behind
+            os.ftruncate(file_descriptor, segment_size)
+        num_of_bytes_written = 0
+        while num_of_bytes_written < len(change_line):
+            num_of_bytes_written += os.write(file_descriptor, change_line[num_of_bytes_written:])
+        self.__committed_size.value += len(change_line)
+
+    def wait_until_durable(self, offset: int):
+        # Returns once the log is on disk up to the given offset
+        if not self.__is_durable or self.__durable_size.value >= offset:
+            return
+        with self.__flush_lock:
+            if self.__durable_size.value >= offset:
+                # Flushed by another writer while this one was waiting for its turn
+                return
+            committed_size = self.__committed_size.value
+            os.fsync(self.__get_file_descriptor(self.__segment_start.value))
+            self.__durable_size.value = max(self.__durable_size.value, committed_size)
+
+    def start_new_segment(self) -> int:
+        # Must be called while holding the writer lock. Changes appended from now on go to a new
+        # segment, which starts at the returned offset.
+        new_segment_start = self.__committed_size.value
+        if new_segment_start == self.__segment_start.value:
+            return new_segment_start
+        with self.__flush_lock:
+            if self.__is_durable:
+                os.fsync(self.__get_file_descriptor(self.__segment_start.value))
+                self.__durable_size.value = new_segment_start
+            open(self.__get_segment_path(new_segment_start), "ab").close()
+            self.__sync_directory()
+            self.__segment_start.value = new_segment_start
+        return new_segment_start
+
+    def remove_segments_before(self, offset: int):
+        # Removes the segments holding only changes from before the given offset
+        segments_starts = self.__get_segments_starts()
+        for segment_start, next_segment_start in zip(segments_starts, segments_starts[1:]):
+            if next_segment_start <= offset:
+                os.remove(self.__get_segment_path(segment_start))
+                self.__close_file_descriptor(segment_start)
+
+    def __drop_partial_change(self, segment_path: str) -> int:
+        # A process that died while appending may leave a partial change at the end of the last segment.
+        # Returns the size of the segment without it.
+        with open(segment_path, "rb+") as segment_file:
+            segment_bytes = segment_file.read()
+            segment_size = segment_bytes.rfind(b"\n") + 1
+            if segment_size < len(segment_bytes):
+                segment_file.truncate(segment_size)
+        return segment_size
+
+    def __sync_directory(self):
+        if self.__is_durable and hasattr(os, "O_DIRECTORY"):
+            directory_file_descriptor = os.open(self.__directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory_file_descriptor)
+            finally:
+                os.close(directory_file_descriptor)
+
+    # --------------------- Queries ---------------------
+
+    def read_changes(self, offset: int):
+        # Returns the changes committed after the given offset, and the offset right after them.
+        # Returns None as the changes when some of them are in segments that were already removed.
+        committed_size = self.__committed_size.value
+        changes = []
+        while offset < committed_size:
+            segment_start = self.__find_segment_start(offset)
+            if segment_start is None:
+                return None, offset
+            try:
+                file_descriptor = self.__get_file_descriptor(segment_start)
+            except FileNotFoundError:
+                return None, offset
+            if segment_start == self.__segment_start.value:
+                segment_end = committed_size
+            else:
+                segment_end = os.fstat(file_descriptor).st_size + segment_start
+            changes_bytes = os.pread(file_descriptor, segment_end - offset, offset - segment_start)
+            changes.extend(json.loads(change_line) for change_line in changes_bytes.splitlines())
+            if segment_start != self.__segment_start.value:
+                # Nothing is appended to older segments, and this process is done reading this one
+                self.__close_file_descriptor(segment_start)
+            offset = segment_end
+        return changes, offset
+
+    def get_committed_size(self) -> int:
+        return self.__committed_size.value
+
+    def get_segment_start(self) -> int:
+        # Offset the segment changes are appended to starts at, which is where the last snapshot was taken
+        return self.__segment_start.value
+
+    def get_first_offset(self) -> int:
+        # Offset of the first change still kept in the log
+        return self.__first_offset
+
+    def get_directory(self) -> str:
+        return self.__directory
+
+    def __find_segment_start(self, offset: int):
+        # Returns the start of the segment holding the given offset, or None if it was removed
+        if offset >= self.__segment_start.value:
+            return self.__segment_start.value
+        segments_starts = [start for start in self.__get_segments_starts() if start <= offset]
+        if len(segments_starts) == 0:
+            return None
+        return segments_starts[-1]
+
+    def __get_segments_starts(self) -> list:
+        segments_starts = []
+        for file_name in os.listdir(self.__directory):
+            match = BooksChangeLog.segment_file_pattern.match(file_name)
+            if match is not None:
+                segments_starts.append(int(match.group(1)))
+        return sorted(segments_starts)
+
+    def __get_segment_path(self, segment_start: int) -> str:
+        return os.path.join(self.__directory, f"changes-{segment_start}.log")
+
+    def __get_file_descriptor(self, segment_start: int):
+        if self.__file_descriptors_pid != os.getpid():
+            self.__file_descriptors = dict()
+            self.__file_descriptors_pid = os.getpid()
+        file_descriptor = self.__file_descriptors.get(segment_start)
+        if file_descriptor is None:
+            file_descriptor = os.open(self.__get_segment_path(segment_start), os.O_RDWR | os.O_APPEND)
+            self.__file_descriptors[segment_start] = file_descriptor
+        return file_descriptor
+
+    def __close_file_descriptor(self, segment_start: int):
+        if self.__file_descriptors_pid == os.getpid() and segment_start in self.__file_descriptors:
+            os.close(self.__file_descriptors.pop(segment_start))
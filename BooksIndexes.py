@@ -0,0 +1,468 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import numpy as np
+
+
+class SortedIndex:
+    # Keeps keys in sorted order inside a list of bounded sorted buckets, so adding or removing
+    # a key costs O(log n) searching plus moving at most a bucket worth of keys.
+    # Keys are (value, id) pairs, which keeps them unique and lets range queries on the value
+    # return the ids of the matching books. A bucket keeps the values and the ids of its keys in two
+    # columns instead of a tuple per key: the ids in an array('q'), and the values too as long as they
+    # are all integers, so an integer key takes 16 bytes.
+
+    bucket_load = 1000
+
+    def __init__(self):
+        self.__values_buckets = []
+        self.__ids_buckets = []
+        # The last key of every bucket, as a (value, id) tuple
+        self.__maxes = []
+        self.__len = 0
+
+    # --------------------- State Changers ---------------------
+
+    def add(self, value, id: int):
+        key = (value, id)
+        if len(self.__maxes) == 0:
+            self.__values_buckets.append(new_values_column([value]))
+            self.__ids_buckets.append(array("q", (id,)))
+            self.__maxes.append(key)
+        else:
+            bucket_index = bisect_left(self.__maxes, key)
+            if bucket_index == len(self.__maxes):
+                bucket_index -= 1
+                position = len(self.__ids_buckets[bucket_index])
+                self.__maxes[bucket_index] = key
+            else:
+                position = self.__find_position(bucket_index, value, id)
+            self.__insert(bucket_index, position, value, id)
+            self.__split_bucket_if_full(bucket_index)
+        self.__len += 1
+
+    def add_many(self, values_and_ids: list):
+        # A big batch is merged by sorting all the keys once and cutting them into new buckets
+        if len(values_and_ids) < max(SortedIndex.bucket_load, self.__len // 8):
+            for value, id in values_and_ids:
+                self.add(value, id)
+            return
+        keys = self.get_keys()
+        keys.extend(values_and_ids)
+        keys.sort()
+        self.load_keys(keys)
+
+    def load_keys(self, sorted_keys: list):
+        # Replaces all the keys with the given (value, id) keys, which must already be sorted
+        self.load_columns([key[0] for key in sorted_keys], [key[1] for key in sorted_keys])
+
+    def load_columns(self, values: list, ids: list):
+        # Replaces all the keys with the keys made of the values and the ids at the same positions, which
+        # must already be sorted as keys
+        load = SortedIndex.bucket_load
+        self.__values_buckets = [new_values_column(values[start:start + load]) for start in range(0, len(ids), load)]
+        self.__ids_buckets = [array("q", ids[start:start + load]) for start in range(0, len(ids), load)]
+        self.__maxes = [(bucket_values[-1], bucket_ids[-1])
+                        for bucket_values, bucket_ids in zip(self.__values_buckets, self.__ids_buckets)]
+        self.__len = len(ids)
+
+    def remove(self, value, id: int):
+        bucket_index = bisect_left(self.__maxes, (value, id))
+        position = self.__find_position(bucket_index, value, id)
+        bucket_values, bucket_ids = self.__values_buckets[bucket_index], self.__ids_buckets[bucket_index]
+        del bucket_values[position]
+        del bucket_ids[position]
+        if len(bucket_ids) == 0:
+            del self.__values_buckets[bucket_index]
+            del self.__ids_buckets[bucket_index]
+            del self.__maxes[bucket_index]
+        else:
+            self.__maxes[bucket_index] = (bucket_values[-1], bucket_ids[-1])
+        self.__len -= 1
+
+    def __insert(self, bucket_index: int, position: int, value, id: int):
+        bucket_values = self.__values_buckets[bucket_index]
+        try:
+            bucket_values.insert(position, value)
+        except (TypeError, OverflowError):
+            # An array of integers can't hold the value, the bucket keeps its values in a list from now on
+            bucket_values = self.__values_buckets[bucket_index] = list(bucket_values)
+            bucket_values.insert(position, value)
+        self.__ids_buckets[bucket_index].insert(position, id)
+
+    def __split_bucket_if_full(self, bucket_index: int):
+        bucket_values, bucket_ids = self.__values_buckets[bucket_index], self.__ids_buckets[bucket_index]
+        load = SortedIndex.bucket_load
+        if len(bucket_ids) > 2 * load:
+            self.__values_buckets.insert(bucket_index + 1, bucket_values[load:])
+            self.__ids_buckets.insert(bucket_index + 1, bucket_ids[load:])
+            del bucket_values[load:]
+            del bucket_ids[load:]
+            self.__maxes.insert(bucket_index, (bucket_values[-1], bucket_ids[-1]))
+
+    # --------------------- Queries ---------------------
+
+    def ids_in_range(self, lowest_value=None, highest_value=None):
+        # Yields the ids of the keys whose value is in [lowest_value, highest_value], in key order.
+        # A bound of None means the range is open on that side.
+        return self.__ids_between(self.__position(lowest_value, bisect_left),
+                                  self.__position(highest_value, bisect_right))
+
+    def ids_after(self, value=None):
+        # Yields the ids of the keys whose value is bigger than the given value, in key order.
+        # None means every key.
+        if value is None:
+            return self.ids_in_range()
+        return self.__ids_between(self.__position(value, bisect_right), self.__position(None, bisect_right))
+
+    def ids_chunks_after(self, value=None):
+        # Yields the ids ids_after yields, a bucket at a time, as array('q') copies of the buckets' ids
+        first_position = (0, 0) if value is None else self.__position(value, bisect_right)
+        return self.__ids_chunks_between(first_position, self.__position(None, bisect_right))
+
+    def __ids_between(self, first_position: tuple, last_position: tuple):
+        for ids_chunk in self.__ids_chunks_between(first_position, last_position):
+            yield from ids_chunk
+
+    def __ids_chunks_between(self, first_position: tuple, last_position: tuple):
+        bucket_index, key_index = first_position
+        last_bucket_index, last_key_index = last_position
+        while bucket_index < last_bucket_index or (bucket_index == last_bucket_index and key_index < last_key_index):
+            bucket_ids = self.__ids_buckets[bucket_index]
+            stop = last_key_index if bucket_index == last_bucket_index else len(bucket_ids)
+            yield bucket_ids[key_index:stop]
+            bucket_index += 1
+            key_index = 0
+
+    def get_keys(self) -> list:
+        # Returns all the keys in sorted order, as (value, id) tuples
+        return [key for bucket_values, bucket_ids in zip(self.__values_buckets, self.__ids_buckets)
+                for key in zip(bucket_values, bucket_ids)]
+
+    def get_columns(self) -> tuple:
+        # Returns the values and the ids of all the keys in sorted order, as two lists
+        return ([value for bucket_values in self.__values_buckets for value in bucket_values],
+                [id for bucket_ids in self.__ids_buckets for id in bucket_ids])
+
+    def count_in_range(self, lowest_value=None, highest_value=None) -> int:
+        return self.__rank(*self.__position(highest_value, bisect_right)) - self.__rank(*self.__position(lowest_value, bisect_left))
+
+    def __find_position(self, bucket_index: int, value, id: int) -> int:
+        # Returns the index inside the bucket of the first key not smaller than (value, id)
+        bucket_values = self.__values_buckets[bucket_index]
+        start = bisect_left(bucket_values, value)
+        end = bisect_right(bucket_values, value, start)
+        return bisect_left(self.__ids_buckets[bucket_index], id, start, end)
+
+    def __position(self, value, bisect_function):
+        # Returns (bucket index, index inside the bucket) of the first key past the value's side
+        if value is None:
+            if bisect_function is bisect_left:
+                return 0, 0
+            return len(self.__maxes), 0
+        bound = (value, float("-inf")) if bisect_function is bisect_left else (value, float("inf"))
+        bucket_index = bisect_left(self.__maxes, bound)
+        if bucket_index == len(self.__maxes):
+            return bucket_index, 0
+        return bucket_index, bisect_function(self.__values_buckets[bucket_index], value)
+
+    def __rank(self, bucket_index: int, key_index: int) -> int:
+        return sum(len(bucket_ids) for bucket_ids in self.__ids_buckets[:bucket_index]) + key_index
+
+    def __len__(self):
+        return self.__len
+
+
+class SortedIds:
+    # Set of ids kept sorted inside a list of bounded array('q') buckets, 8 bytes per id, so adding or
+    # removing an id costs O(log n) searching plus moving at most a bucket worth of ids
+
+    bucket_load = 1000
+
+    def __init__(self, sorted_ids=()):
+        # sorted_ids: sorted list or numpy array of ids
+        load = SortedIds.bucket_load
+        sorted_ids = np.asarray(sorted_ids, dtype=np.int64)
+        self.__buckets = [array("q", sorted_ids[start:start + load].tobytes())
+                          for start in range(0, len(sorted_ids), load)]
+        self.__maxes = [bucket[-1] for bucket in self.__buckets]
+        self.__len = len(sorted_ids)
+
+    def add(self, id: int):
+        if len(self.__buckets) == 0:
+            self.__buckets.append(array("q", (id,)))
+            self.__maxes.append(id)
+            self.__len += 1
+            return
+        bucket_index = bisect_left(self.__maxes, id)
+        if bucket_index == len(self.__maxes):
+            bucket_index -= 1
+            self.__buckets[bucket_index].append(id)
+            self.__maxes[bucket_index] = id
+        else:
+            bucket = self.__buckets[bucket_index]
+            position = bisect_left(bucket, id)
+            if bucket[position] == id:
+                return
+            bucket.insert(position, id)
+        self.__len += 1
+        bucket = self.__buckets[bucket_index]
+        if len(bucket) > 2 * SortedIds.bucket_load:
+            self.__buckets.insert(bucket_index + 1, bucket[SortedIds.bucket_load:])
+            del bucket[SortedIds.bucket_load:]
+            self.__maxes.insert(bucket_index, bucket[-1])
+
+    def discard(self, id: int):
+        bucket_index = bisect_left(self.__maxes, id)
+        if bucket_index == len(self.__maxes):
+            return
+        bucket = self.__buckets[bucket_index]
+        position = bisect_left(bucket, id)
+        if bucket[position] != id:
+            return
+        del bucket[position]
+        if len(bucket) == 0:
+            del self.__buckets[bucket_index]
+            del self.__maxes[bucket_index]
+        else:
+            self.__maxes[bucket_index] = bucket[-1]
+        self.__len -= 1
+
+    def __iter__(self):
+        for bucket in self.__buckets:
+            yield from bucket
+
+    def __len__(self):
+        return self.__len
+
+
+class InvertedIndex:
+    # Maps every value to the ids of the books holding it, kept in a SortedIds
+
+    def __init__(self):
+        self.__ids_of_value = dict()
+
+    def add(self, value, id: int):
+        ids = self.__ids_of_value.get(value)
+        if ids is None:
+            ids = self.__ids_of_value[value] = SortedIds()
+        ids.add(id)
+
+    def remove(self, value, id: int):
+        ids = self.__ids_of_value[value]
+        ids.discard(id)
+        if len(ids) == 0:
+            del self.__ids_of_value[value]
+
+    def load_ids_of_values(self, ids_of_value: dict):
+        # Replaces the whole index with the given value -> sorted list or numpy array of ids dictionary
+        self.__ids_of_value = {value: SortedIds(ids) for value, ids in ids_of_value.items()}
+
+    def get_ids_of_values(self) -> dict:
+        # Returns a copy of the whole index, as a value -> sorted list of ids dictionary
+        return {value: list(ids) for value, ids in self.__ids_of_value.items()}
+
+    def get_ids(self, value):
+        # Returns the ids of the books holding the value, in increasing order
+        return self.__ids_of_value.get(value, ())
+
+    def count(self, value) -> int:
+        return len(self.__ids_of_value.get(value, ()))
+
+    def __len__(self):
+        return len(self.__ids_of_value)
+
+
+class TrigramIndex:
+    # Maps every three characters long piece (trigram) of the indexed texts to the ids of the texts
+    # holding it, so the texts containing a string are found by intersecting the ids of its trigrams,
+    # without reading any other text.
+    # The ids of a trigram are kept sorted in an array('q'), 8 bytes per id, and arrays are intersected
+    # by binary searches of the smaller one's ids in the bigger one. Removed ids are only remembered,
+    # and dropped from the arrays in one pass once there are many of them, so the candidates returned
+    # may include removed ids, and texts that hold all the trigrams but not the string.
+    # A trigram is coded as the 63 bits integer made of its 3 code points (21 bits each), see encode_trigram.
+
+    min_removed_ids_for_purge = 1024
+    # Batches at least this big are indexed with numpy, all the trigrams of up to max_vectorized_batch_size
+    # texts at once
+    min_batch_size_to_vectorize = 1000
+    max_vectorized_batch_size = 100000
+
+    def __init__(self):
+        self.__ids_of_trigram = dict()
+        self.__removed_ids = set()
+        self.__num_of_ids = 0
+
+    # --------------------- State Changers ---------------------
+
+    def add(self, text: str, id: int):
+        ids_of_trigram = self.__ids_of_trigram
+        for trigram in get_trigrams(text):
+            ids = ids_of_trigram.get(trigram)
+            if ids is None:
+                ids_of_trigram[trigram] = array("q", (id,))
+            elif len(ids) == 0 or ids[-1] < id:
+                ids.append(id)
+            else:
+                ids.insert(bisect_left(ids, id), id)
+        self.__num_of_ids += 1
+
+    def add_many(self, texts: list, ids: list):
+        self.add_postings(self.get_postings(texts, ids), len(texts))
+
+    def add_postings(self, postings: list, num_of_texts: int):
+        # Adds the postings get_postings returned for num_of_texts texts
+        ids_of_trigram = self.__ids_of_trigram
+        for trigram, new_ids in postings:
+            ids = ids_of_trigram.get(trigram)
+            if ids is None:
+                ids_of_trigram[trigram] = new_ids
+            elif len(ids) == 0 or ids[-1] < new_ids[0]:
+                ids.extend(new_ids)
+            elif len(new_ids) < 16:
+                for id in new_ids:
+                    ids.insert(bisect_left(ids, id), id)
+            else:
+                ids_of_trigram[trigram] = array("q", np.union1d(np.array(ids, dtype=np.int64),
+                                                                np.array(new_ids, dtype=np.int64)).tobytes())
+        self.__num_of_ids += num_of_texts
+
+    def get_postings(self, texts: list, ids: list) -> list:
+        # Returns the trigrams of the texts, each with the sorted ids of the texts holding it in an
+        # array('q'), without changing the index. Adding them with add_postings can't fail, so a batch is
+        # indexed by computing its postings before changing anything else.
+        if len(texts) < TrigramIndex.min_batch_size_to_vectorize:
+            ids_of_trigram = dict()
+            for text, id in zip(texts, ids):
+                for trigram in get_trigrams(text):
+                    ids_of_trigram.setdefault(trigram, []).append(id)
+            return [(trigram, array("q", sorted(trigram_ids))) for trigram, trigram_ids in ids_of_trigram.items()]
+        postings = []
+        batch_size = TrigramIndex.max_vectorized_batch_size
+        for batch_start in range(0, len(texts), batch_size):
+            postings.extend(self.__get_batch_postings(texts[batch_start:batch_start + batch_size],
+                                                      ids[batch_start:batch_start + batch_size]))
+        return postings
+
+    def __get_batch_postings(self, texts: list, ids: list) -> list:
+        # Every character becomes a code point in one array, and every trigram its code. Lone surrogates,
+        # which JSON strings may hold, are code points like any other.
+        # Trigrams starting in the last 2 characters of a text are dropped.
+        texts_bytes = "".join(texts).encode("utf-32-le", "surrogatepass")
+        code_points = np.frombuffer(texts_bytes, dtype=np.uint32).astype(np.int64)
+        texts_lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        trigrams_codes = (code_points[:-2] << 42) | (code_points[1:-1] << 21) | code_points[2:]
+        texts_ids = np.repeat(np.array(ids, dtype=np.int64), texts_lengths)[:-2]
+        trigrams_ends = np.arange(2, len(code_points))
+        texts_ends = np.repeat(np.cumsum(texts_lengths), texts_lengths)[:-2]
+        is_in_text = trigrams_ends < texts_ends
+        trigrams_codes, texts_ids = trigrams_codes[is_in_text], texts_ids[is_in_text]
+
+        # Group the ids by trigram, sorted and without the ids of texts repeating a trigram
+        order = np.lexsort((texts_ids, trigrams_codes))
+        trigrams_codes, texts_ids = trigrams_codes[order], texts_ids[order]
+        is_first = np.ones(len(trigrams_codes), dtype=np.bool_)
+        is_first[1:] = (trigrams_codes[1:] != trigrams_codes[:-1]) | (texts_ids[1:] != texts_ids[:-1])
+        trigrams_codes, texts_ids = trigrams_codes[is_first], texts_ids[is_first]
+        groups_starts = np.flatnonzero(np.concatenate(([True], trigrams_codes[1:] != trigrams_codes[:-1])))
+        groups_ends = np.append(groups_starts[1:], len(trigrams_codes))
+        return [(decode_trigram(trigram_code), array("q", texts_ids[start:end].tobytes()))
+                for trigram_code, start, end in zip(trigrams_codes[groups_starts].tolist(), groups_starts.tolist(),
+                                                    groups_ends.tolist())]
+
+    def load_columns(self, trigrams_codes, offsets, ids, num_of_ids: int):
+        # Replaces the index with the one get_columns returned, for num_of_ids texts
+        trigrams_codes, offsets = trigrams_codes.tolist(), offsets.tolist()
+        self.__ids_of_trigram = {decode_trigram(trigram_code): array("q", ids[start:end].tobytes())
+                                 for trigram_code, start, end in zip(trigrams_codes, offsets, offsets[1:])}
+        self.__removed_ids = set()
+        self.__num_of_ids = num_of_ids
+
+    def remove(self, id: int):
+        self.__removed_ids.add(id)
+        if (len(self.__removed_ids) >= TrigramIndex.min_removed_ids_for_purge
+                and len(self.__removed_ids) * 4 >= self.__num_of_ids):
+            self.__purge_removed_ids()
+
+    def __purge_removed_ids(self):
+        removed_ids = np.fromiter(self.__removed_ids, dtype=np.int64, count=len(self.__removed_ids))
+        for trigram, ids in list(self.__ids_of_trigram.items()):
+            ids_array = np.array(ids, dtype=np.int64)
+            kept_ids = ids_array[~np.isin(ids_array, removed_ids)]
+            if len(kept_ids) == 0:
+                del self.__ids_of_trigram[trigram]
+            elif len(kept_ids) < len(ids_array):
+                self.__ids_of_trigram[trigram] = array("q", kept_ids.tobytes())
+        self.__num_of_ids -= len(self.__removed_ids)
+        self.__removed_ids = set()
+
+    # --------------------- Queries ---------------------
+
+    def count_candidates(self, string: str) -> int:
+        # Returns how many ids get_candidates returns at most, without finding them
+        trigrams = get_trigrams(string)
+        if len(trigrams) == 0:
+            return self.__num_of_ids
+        return min(len(self.__ids_of_trigram.get(trigram, ())) for trigram in trigrams)
+
+    def get_candidates(self, string: str):
+        # Returns the sorted ids of the texts that may contain the string as a numpy array, or None
+        # when the string is shorter than a trigram and any text may contain it.
+        # The ids of trigrams most texts hold are not intersected: they would drop few candidates, for
+        # a binary search of every candidate.
+        trigrams = get_trigrams(string)
+        if len(trigrams) == 0:
+            return None
+        ids_of_trigrams = sorted((self.__ids_of_trigram.get(trigram, ()) for trigram in trigrams), key=len)
+        candidates = np.array(ids_of_trigrams[0], dtype=np.int64)
+        for ids in ids_of_trigrams[1:]:
+            if len(candidates) == 0 or len(ids) * 2 > self.__num_of_ids:
+                break
+            # A view of the array, only alive while the caller keeps the index from changing
+            ids_view = np.frombuffer(ids, dtype=np.int64)
+            positions = np.minimum(np.searchsorted(ids_view, candidates), len(ids_view) - 1)
+            candidates = candidates[ids_view[positions] == candidates]
+            del ids_view
+        return candidates
+
+    def get_columns(self) -> tuple:
+        # Returns the codes of the trigrams, the offsets of their ids' groups, and the ids of every trigram
+        # one group after the other, as numpy arrays. Removed ids are left out.
+        trigrams_codes = np.fromiter(map(encode_trigram, self.__ids_of_trigram), dtype=np.int64,
+                                     count=len(self.__ids_of_trigram))
+        groups_sizes = np.fromiter(map(len, self.__ids_of_trigram.values()), dtype=np.int64,
+                                   count=len(self.__ids_of_trigram))
+        ids = np.frombuffer(b"".join(ids.tobytes() for ids in self.__ids_of_trigram.values()), dtype=np.int64)
+        if len(self.__removed_ids) > 0:
+            removed_ids = np.fromiter(self.__removed_ids, dtype=np.int64, count=len(self.__removed_ids))
+            is_kept = ~np.isin(ids, removed_ids)
+            groups_sizes = np.bincount(np.repeat(np.arange(len(groups_sizes)), groups_sizes)[is_kept],
+                                       minlength=len(groups_sizes))
+            ids = ids[is_kept]
+            trigrams_codes, groups_sizes = trigrams_codes[groups_sizes > 0], groups_sizes[groups_sizes > 0]
+        offsets = np.zeros(len(groups_sizes) + 1, dtype=np.int64)
+        np.cumsum(groups_sizes, out=offsets[1:])
+        return trigrams_codes, offsets, ids
+
+    def __len__(self):
+        return len(self.__ids_of_trigram)
+
+
+def new_values_column(values: list):
+    # Returns the values in an array('q') when they are all integers it can hold, and in a list otherwise
+    try:
+        return array("q", values)
+    except (TypeError, OverflowError):
+        return list(values)
+
+
+def encode_trigram(trigram: str) -> int:
+    return (ord(trigram[0]) << 42) | (ord(trigram[1]) << 21) | ord(trigram[2])
+
+
+def decode_trigram(trigram_code: int) -> str:
+    return chr(trigram_code >> 42) + chr((trigram_code >> 21) & 0x1FFFFF) + chr(trigram_code & 0x1FFFFF)
+
+
+def get_trigrams(text: str) -> set:
+    return {text[start:start + 3] for start in range(len(text) - 2)}
@@ -0,0 +1,233 @@
+import json
+import os
+import re
+import shutil
+import numpy as np
+from BooksStorage import CodedValues, value_key
+
+
+class BooksSnapshot:
+    # Compact binary snapshot of the catalog, written as one directory of column files.
+    # Integer and float columns are saved as .npy arrays, columns repeating a few values as the
+    # distinct values plus an array of codes, string columns as one text blob, and any other column
+    # as a single JSON document. Derived columns of bytes, like the JSON encodings of the books, are saved
+    # as one blob of all the values plus an array of their offsets, so they are not computed again.
+    # Arrays are loaded memory mapped, so a snapshot is read with a handful of bulk copies instead of
+    # row by row.
+    # The keys of the sorted indexes, the ids of the inverted indexes and the ids of every trigram of the
+    # text index are saved as well, already in order, so loading a snapshot doesn't need to sort, regroup
+    # or search the books again.
+    # Snapshots are named after the change log offset they were taken at. A snapshot is written
+    # to a temporary directory and renamed once complete, so a half written snapshot is never loaded.
+
+    snapshot_directory_pattern = re.compile(r"^snapshot-(\d+)$")
+    metadata_file_name = "metadata.json"
+    # Separates the strings of a column in its text file. Columns holding it in one of their strings
+    # are saved as JSON instead.
+    strings_separator = "\x00"
+
+    @staticmethod
+    def save(directory: str, change_log_offset: int, columns: dict, derived_columns: dict, sorted_indexes: dict,
+             inverted_indexes: dict, text_index: tuple, properties: dict) -> str:
+        # columns: column name -> list of values
+        # derived_columns: derived column name -> list of bytes, one per row of the columns
+        # sorted_indexes: index name -> (values, ids) lists of the keys in sorted order
+        # inverted_indexes: index name -> dictionary of value -> sorted collection of ids
+        # text_index: (trigrams codes, offsets, ids) numpy arrays, see TrigramIndex.get_columns
+        # properties: anything JSON serializable the store needs back
+        snapshot_path = BooksSnapshot.get_path(directory, change_log_offset)
+        temporary_path = snapshot_path + ".tmp"
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+
+        metadata = {"properties": properties, "columns": {}, "derivedColumns": [], "sortedIndexes": {},
+                    "invertedIndexes": []}
+        for column_name, values in columns.items():
+            metadata["columns"][column_name] = save_column(temporary_path, f"column-{column_name}", values)
+        for column_name, values in derived_columns.items():
+            save_bytes_column(temporary_path, f"derived-{column_name}", values)
+            metadata["derivedColumns"].append(column_name)
+        for index_name, (values, ids) in sorted_indexes.items():
+            values_kind = save_column(temporary_path, f"sorted-{index_name}-values", values)
+            np.save(os.path.join(temporary_path, f"sorted-{index_name}-ids.npy"), np.array(ids, dtype=np.int64))
+            metadata["sortedIndexes"][index_name] = values_kind
+        for index_name, ids_of_value in inverted_indexes.items():
+            save_inverted_index(temporary_path, index_name, ids_of_value)
+            metadata["invertedIndexes"].append(index_name)
+        for array_name, values in zip(("trigrams", "offsets", "ids"), text_index):
+            np.save(os.path.join(temporary_path, f"text-{array_name}.npy"), values)
+        metadata["textIndex"] = True
+        with open(os.path.join(temporary_path, BooksSnapshot.metadata_file_name), "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+
+        for file_name in os.listdir(temporary_path):
+            sync_file(os.path.join(temporary_path, file_name))
+        os.rename(temporary_path, snapshot_path)
+        sync_directory(directory)
+        return snapshot_path
+
+    @staticmethod
+    def load(snapshot_path: str):
+        # Returns (properties, columns, derived_columns, sorted_indexes, inverted_indexes, text_index) in the
+        # shapes given to save, except that columns saved as codes are given as CodedValues. The arrays of
+        # the text index are memory mapped, and it is None in snapshots saved without it. Snapshots saved
+        # without derived columns give none back.
+        with open(os.path.join(snapshot_path, BooksSnapshot.metadata_file_name)) as metadata_file:
+            metadata = json.load(metadata_file)
+        columns = {column_name: load_column(snapshot_path, f"column-{column_name}", column_kind)
+                   for column_name, column_kind in metadata["columns"].items()}
+        derived_columns = {column_name: load_bytes_column(snapshot_path, f"derived-{column_name}")
+                           for column_name in metadata.get("derivedColumns", [])}
+        sorted_indexes = {}
+        for index_name, values_kind in metadata["sortedIndexes"].items():
+            values = list(load_column(snapshot_path, f"sorted-{index_name}-values", values_kind))
+            ids = np.load(os.path.join(snapshot_path, f"sorted-{index_name}-ids.npy"), mmap_mode="r").tolist()
+            sorted_indexes[index_name] = (values, ids)
+        inverted_indexes = {index_name: load_inverted_index(snapshot_path, index_name)
+                            for index_name in metadata["invertedIndexes"]}
+        text_index = None
+        if metadata.get("textIndex", False):
+            text_index = tuple(np.load(os.path.join(snapshot_path, f"text-{array_name}.npy"), mmap_mode="r")
+                               for array_name in ("trigrams", "offsets", "ids"))
+        return metadata["properties"], columns, derived_columns, sorted_indexes, inverted_indexes, text_index
+
+    @staticmethod
+    def get_path(directory: str, change_log_offset: int) -> str:
+        return os.path.join(directory, f"snapshot-{change_log_offset}")
+
+    @staticmethod
+    def find_latest(directory: str):
+        # Returns (change log offset, path) of the latest complete snapshot, or (None, None) if there is none
+        snapshots_offsets = BooksSnapshot.__get_snapshots_offsets(directory)
+        if len(snapshots_offsets) == 0:
+            return None, None
+        return snapshots_offsets[-1], BooksSnapshot.get_path(directory, snapshots_offsets[-1])
+
+    @staticmethod
+    def remove_before(directory: str, change_log_offset: int):
+        for snapshot_offset in BooksSnapshot.__get_snapshots_offsets(directory):
+            if snapshot_offset < change_log_offset:
+                shutil.rmtree(BooksSnapshot.get_path(directory, snapshot_offset), ignore_errors=True)
+
+    @staticmethod
+    def __get_snapshots_offsets(directory: str) -> list:
+        snapshots_offsets = []
+        for file_name in os.listdir(directory):
+            match = BooksSnapshot.snapshot_directory_pattern.match(file_name)
+            if match is not None:
+                snapshots_offsets.append(int(match.group(1)))
+        return sorted(snapshots_offsets)
+
+
+def save_column(directory: str, name: str, values: list) -> str:
+    # Saves the values in the most compact form that gives them back exactly as they were, and
+    # returns the kind of that form
+    if all(type(value) is int for value in values):
+        try:
+            np.save(os.path.join(directory, f"{name}.npy"), np.array(values, dtype=np.int64))
+            return "int"
+        except OverflowError:
+            pass
+    elif all(type(value) is float for value in values):
+        np.save(os.path.join(directory, f"{name}.npy"), np.array(values, dtype=np.float64))
+        return "float"
+
+    # Columns repeating a few values, like authors or genres, keep every distinct value once
+    # and an array of codes pointing at them
+    if is_worth_coding(values):
+        code_of_value = dict()
+        codes = [code_of_value.setdefault(value_key(value), len(code_of_value)) for value in values]
+        values_of_codes = [None] * len(code_of_value)
+        for value, code in zip(values, codes):
+            values_of_codes[code] = value
+        with open(os.path.join(directory, f"{name}-values.json"), "w") as json_file:
+            json.dump(values_of_codes, json_file, separators=(",", ":"))
+        np.save(os.path.join(directory, f"{name}-codes.npy"), np.array(codes, dtype=np.int32))
+        return "codes"
+
+    if all(type(value) is str for value in values):
+        text = BooksSnapshot.strings_separator.join(values)
+        if text.count(BooksSnapshot.strings_separator) == len(values) - 1:
+            with open(os.path.join(directory, f"{name}.txt"), "w", encoding="utf-8", errors="surrogatepass", newline="") as text_file:
+                text_file.write(text)
+            return "str"
+    with open(os.path.join(directory, f"{name}.json"), "w") as json_file:
+        json.dump(values, json_file, separators=(",", ":"))
+    return "json"
+
+
+def load_column(directory: str, name: str, kind: str):
+    # Returns the values saved by save_column, as CodedValues when they were saved as codes
+    if kind in ("int", "float"):
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r").tolist()
+    if kind == "codes":
+        with open(os.path.join(directory, f"{name}-values.json")) as json_file:
+            values_of_codes = json.load(json_file)
+        return CodedValues(values_of_codes, np.load(os.path.join(directory, f"{name}-codes.npy"), mmap_mode="r"))
+    if kind == "str":
+        with open(os.path.join(directory, f"{name}.txt"), encoding="utf-8", errors="surrogatepass", newline="") as text_file:
+            return text_file.read().split(BooksSnapshot.strings_separator)
+    with open(os.path.join(directory, f"{name}.json")) as json_file:
+        return json.load(json_file)
+
+
+def save_bytes_column(directory: str, name: str, values: list):
+    # All the values are saved in one blob, with the offset of every value
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, values), dtype=np.int64, count=len(values)), out=offsets[1:])
+    np.save(os.path.join(directory, f"{name}.npy"), np.frombuffer(b"".join(values), dtype=np.uint8))
+    np.save(os.path.join(directory, f"{name}-offsets.npy"), offsets)
+
+
+def load_bytes_column(directory: str, name: str) -> list:
+    blob = memoryview(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+    offsets = np.load(os.path.join(directory, f"{name}-offsets.npy"), mmap_mode="r").tolist()
+    return [blob[start:end].tobytes() for start, end in zip(offsets, offsets[1:])]
+
+
+def is_worth_coding(values: list) -> bool:
+    # Judged by a sample of the values, which must all be hashable as value keys
+    sample = values[:10000]
+    try:
+        return len(set(map(value_key, sample))) * 2 <= len(sample) and len(set(map(value_key, values))) * 2 <= len(values)
+    except TypeError:
+        return False
+
+
+def save_inverted_index(directory: str, name: str, ids_of_value: dict):
+    # All the ids are saved in one array, grouped by value, with the offset of every group
+    values = list(ids_of_value.keys())
+    ids_groups = [ids_of_value[value] for value in values]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(ids) for ids in ids_groups], out=offsets[1:])
+    ids = np.fromiter((id for ids in ids_groups for id in ids), dtype=np.int64, count=int(offsets[-1]))
+    with open(os.path.join(directory, f"inverted-{name}-values.json"), "w") as json_file:
+        json.dump(values, json_file)
+    np.save(os.path.join(directory, f"inverted-{name}-ids.npy"), ids)
+    np.save(os.path.join(directory, f"inverted-{name}-offsets.npy"), offsets)
+
+
+def load_inverted_index(directory: str, name: str) -> dict:
+    with open(os.path.join(directory, f"inverted-{name}-values.json")) as json_file:
+        values = json.load(json_file)
+    ids = np.load(os.path.join(directory, f"inverted-{name}-ids.npy"), mmap_mode="r")
+    offsets = np.load(os.path.join(directory, f"inverted-{name}-offsets.npy"), mmap_mode="r").tolist()
+    # Snapshots written while the indexes held sets may hold the ids of a value in any order
+    return {value: np.sort(ids[start:end]) for value, start, end in zip(values, offsets, offsets[1:])}
+
+
+def sync_file(path: str):
+    file_descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+def sync_directory(path: str):
+    if hasattr(os, "O_DIRECTORY"):
+        file_descriptor = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(file_descriptor)
+        finally:
+            os.close(file_descriptor)
@@ -0,0 +1,74 @@
+class BooksStats:
+    # Aggregates of a set of books: how many books there are per genre, per publication year and per
+    # price, kept up to date in O(1) on every added book, price update and removed book.
+    # Price buckets, the lowest, highest and mean price are all read from the count per distinct price,
+    # so they stay exact whatever books are removed, at the cost of going over the distinct prices.
+    # A value whose count drops to zero is forgotten.
+
+    # Prices are counted in buckets of this size, named after their lowest price
+    price_bucket_size = 50
+
+    def __init__(self):
+        self.__num_of_books = 0
+        self.__count_of_genre = dict()
+        self.__count_of_year = dict()
+        self.__count_of_price = dict()
+
+    # --------------------- State Changers ---------------------
+
+    def add_book(self, book: dict):
+        self.add_counts({book["price"]: 1}, {book["year"]: 1}, dict.fromkeys(set(book["genres"]), 1))
+
+    def remove_book(self, book: dict):
+        self.add_counts({book["price"]: -1}, {book["year"]: -1}, dict.fromkeys(set(book["genres"]), -1))
+
+    def update_price(self, old_price, new_price):
+        add_count(self.__count_of_price, old_price, -1)
+        add_count(self.__count_of_price, new_price, 1)
+
+    def add_counts(self, count_of_price: dict, count_of_year: dict, count_of_genre: dict):
+        # Adds books by their counts per price, per year and per genre. Every book has one price and one
+        # year and any number of genres, so the books added are counted by their prices.
+        for price, count in count_of_price.items():
+            add_count(self.__count_of_price, price, count)
+            self.__num_of_books += count
+        for year, count in count_of_year.items():
+            add_count(self.__count_of_year, year, count)
+        for genre, count in count_of_genre.items():
+            add_count(self.__count_of_genre, genre, count)
+
+    # --------------------- Queries ---------------------
+
+    def to_dict(self, genres: list) -> dict:
+        # Returns the aggregates as they are answered by GET /books/stats. Every genre in genres is
+        # listed, even when no book has it.
+        count_of_price_bucket = dict()
+        for price in sorted(self.__count_of_price):
+            add_count(count_of_price_bucket, get_price_bucket(price), self.__count_of_price[price])
+        prices_sum = sum(price * count for price, count in self.__count_of_price.items())
+        return {"total": self.__num_of_books,
+                "genres": {genre: self.__count_of_genre.get(genre, 0)
+                           for genre in dict.fromkeys(list(genres) + list(self.__count_of_genre))},
+                "years": dict(sorted(self.__count_of_year.items())),
+                "priceBucketSize": BooksStats.price_bucket_size,
+                "priceBuckets": count_of_price_bucket,
+                "minPrice": min(self.__count_of_price, default=None),
+                "maxPrice": max(self.__count_of_price, default=None),
+                "meanPrice": prices_sum / self.__num_of_books if self.__num_of_books > 0 else None}
+
+    def __len__(self):
+        return self.__num_of_books
+
+
+def add_count(count_of_value: dict, value, count: int):
+    new_count = count_of_value.get(value, 0) + count
+    if new_count == 0:
+        count_of_value.pop(value, None)
+    else:
+        count_of_value[value] = new_count
+
+
+def get_price_bucket(price):
+    # Lowest price of the bucket holding the price, as an int whenever it is a whole number
+    bucket = price // BooksStats.price_bucket_size * BooksStats.price_bucket_size
+    return int(bucket) if isinstance(bucket, float) and bucket.is_integer() else bucket
@@ -0,0 +1,376 @@
+import sys
+from array import array
+import numpy as np
+import pandas as pd
+
+
+class BooksStorage:
+    # Column oriented storage engine behind BookStore.
+    # Every column is kept in its own growable sequence, so appending a book is amortized O(1)
+    # instead of copying the whole DataFrame. A DataFrame view of the stored books is only
+    # materialized when someone asks for it, and is reused until the next change.
+    # Rows are found through a key -> slot index. Removing a row only marks its slot as dead,
+    # and dead slots are compacted away in one pass once they make up a large part of the columns.
+    #
+    # Columns are stored according to their kind:
+    #   "int"      - machine integers in an array('q'), 8 bytes per row instead of a pointer to an int object
+    #   "interned" - strings interned once, so rows repeating a value share one string object
+    #   "coded"    - every distinct value kept once, and an array('q') of codes pointing at it per row.
+    #                Codes are never reassigned, until the columns are loaded again.
+    #   "object"   - any Python value, in a list
+    # A column gets the "object" kind from the first value its kind can't hold exactly (like a float
+    # price or an unhashable genres list), so every value is always given back the way it was stored.
+    # Values of coded columns are shared between the rows holding them, and must not be changed.
+    #
+    # Derived columns hold a value computed from every row, like an encoding of it. The value is computed
+    # when the row is stored and again whenever the row changes, and is left out of the rows and columns
+    # given back.
+
+    min_dead_slots_for_compaction = 1024
+    columns_kinds = ("int", "interned", "coded", "object")
+
+    def __init__(self, columns_names: list, key_column_name: str = "id", kinds_of_columns: dict = None,
+                 derived_columns: dict = None):
+        self.__columns_names = list(columns_names)
+        self.__key_column_name = key_column_name
+        # kinds_of_columns: column name -> kind, columns not in it hold objects
+        self.__kind_of_column = {column_name: (kinds_of_columns or {}).get(column_name, "object")
+                                 for column_name in self.__columns_names}
+        if not all(column_kind in BooksStorage.columns_kinds for column_kind in self.__kind_of_column.values()):
+            raise ValueError("Unknown kind of column.")
+        self.__requested_kind_of_column = dict(self.__kind_of_column)
+        self.__columns = {column_name: self.__new_column(column_name) for column_name in self.__columns_names}
+        # derived_columns: derived column name -> function computing its value from a row dictionary
+        self.__derive_of_column = dict(derived_columns or {})
+        self.__derived_columns = {column_name: [] for column_name in self.__derive_of_column}
+        # Distinct values of every coded column by code, and the code of every distinct value key
+        self.__values_of_codes = {column_name: [] for column_name in self.__columns_names}
+        self.__code_of_value = {column_name: dict() for column_name in self.__columns_names}
+        self.__is_alive = bytearray()
+        self.__slot_of_key = dict()
+        self.__num_of_dead_slots = 0
+        self.__books_data_df = None
+
+    # --------------------- State Changers ---------------------
+
+    def append(self, row: dict) -> int:
+        slot = len(self.__is_alive)
+        for column_name in self.__columns_names:
+            # Encoded first, since encoding may replace the column
+            value = self.__encode(column_name, row[column_name])
+            self.__columns[column_name].append(value)
+        for column_name, derive in self.__derive_of_column.items():
+            self.__derived_columns[column_name].append(derive(row))
+        self.__is_alive.append(True)
+        self.__slot_of_key[row[self.__key_column_name]] = slot
+        self.__books_data_df = None
+        return slot
+
+    def append_many(self, rows: list):
+        first_slot = len(self.__is_alive)
+        for column_name in self.__columns_names:
+            values = self.__encode_all(column_name, [row[column_name] for row in rows])
+            self.__columns[column_name].extend(values)
+        for column_name, derive in self.__derive_of_column.items():
+            self.__derived_columns[column_name].extend(map(derive, rows))
+        self.__is_alive.extend(b"\x01" * len(rows))
+        for slot, row in enumerate(rows, start=first_slot):
+            self.__slot_of_key[row[self.__key_column_name]] = slot
+        self.__books_data_df = None
+
+    def set_value(self, slot: int, column_name: str, value):
+        self.__columns[column_name][slot] = self.__encode(column_name, value)
+        if len(self.__derive_of_column) > 0:
+            row = self.get_row(slot)
+            for derived_column_name, derive in self.__derive_of_column.items():
+                self.__derived_columns[derived_column_name][slot] = derive(row)
+        self.__books_data_df = None
+
+    def remove(self, slot: int):
+        key = self.get_value(slot, self.__key_column_name)
+        del self.__slot_of_key[key]
+        self.__is_alive[slot] = False
+        for derived_column in self.__derived_columns.values():
+            derived_column[slot] = None
+        self.__num_of_dead_slots += 1
+        self.__books_data_df = None
+        if self.__should_compact():
+            self.compact()
+
+    def compact(self):
+        # Drop the dead slots from every column. Slots of the remaining rows change, keys and codes don't
+        alive_slots = list(self.alive_slots())
+        for column_name in self.__columns_names:
+            column = self.__columns[column_name]
+            compacted_column = self.__new_column(column_name)
+            compacted_column.extend([column[slot] for slot in alive_slots])
+            self.__columns[column_name] = compacted_column
+        for column_name, derived_column in self.__derived_columns.items():
+            self.__derived_columns[column_name] = [derived_column[slot] for slot in alive_slots]
+        self.__is_alive = bytearray(b"\x01" * len(alive_slots))
+        keys = self.__get_values(self.__key_column_name)
+        self.__slot_of_key = {key: slot for slot, key in enumerate(keys)}
+        self.__num_of_dead_slots = 0
+        self.__books_data_df = None
+
+    def load_columns(self, columns: dict, derived_columns: dict = None):
+        # Replaces all the stored rows with the given columns of values, each a list or a CodedValues.
+        # The derived columns given, as returned by get_derived_columns, are taken as they are, the others
+        # are computed from the rows.
+        derived_columns = derived_columns or {}
+        for column_name in self.__columns_names:
+            self.__kind_of_column[column_name] = self.__requested_kind_of_column[column_name]
+            self.__values_of_codes[column_name] = []
+            self.__code_of_value[column_name] = dict()
+            # The previous rows are dropped first, since loading may move the column to the object kind
+            self.__columns[column_name] = self.__new_column(column_name)
+            self.__columns[column_name] = self.__load_column(column_name, columns[column_name])
+        keys = columns[self.__key_column_name]
+        derived_columns_to_compute = dict()
+        for column_name, derive in self.__derive_of_column.items():
+            if column_name in derived_columns:
+                self.__derived_columns[column_name] = list(derived_columns[column_name])
+            else:
+                derived_columns_to_compute[column_name] = derive
+        if len(derived_columns_to_compute) > 0:
+            rows = [dict(zip(self.__columns_names, row_values))
+                    for row_values in zip(*(columns[column_name] for column_name in self.__columns_names))]
+            for column_name, derive in derived_columns_to_compute.items():
+                self.__derived_columns[column_name] = list(map(derive, rows))
+        self.__is_alive = bytearray(b"\x01" * len(keys))
+        self.__slot_of_key = dict(zip(keys, range(len(keys))))
+        self.__num_of_dead_slots = 0
+        self.__books_data_df = None
+
+    def __load_column(self, column_name: str, values):
+        if isinstance(values, CodedValues):
+            column_kind = self.__kind_of_column[column_name]
+            values_of_codes = values.get_values_of_codes()
+            if column_kind == "coded":
+                # The codes are taken as they are, unless the values can't be told apart by their keys
+                try:
+                    code_of_value = {value_key(value): code for code, value in enumerate(values_of_codes)}
+                except TypeError:
+                    code_of_value = None
+                if code_of_value is not None and len(code_of_value) == len(values_of_codes):
+                    self.__values_of_codes[column_name] = list(values_of_codes)
+                    self.__code_of_value[column_name] = code_of_value
+                    return array("q", values.get_codes().astype(np.int64).tobytes())
+            elif column_kind == "interned":
+                values_of_codes = self.__encode_all(column_name, values_of_codes)
+                return [values_of_codes[code] for code in values.get_codes().tolist()]
+            values = list(values)
+        # Encoded first, since encoding may change the kind of the column
+        values = self.__encode_all(column_name, values)
+        column = self.__new_column(column_name)
+        column.extend(values)
+        return column
+
+    def __should_compact(self):
+        return (self.__num_of_dead_slots >= BooksStorage.min_dead_slots_for_compaction
+                and self.__num_of_dead_slots * 2 >= len(self.__is_alive))
+
+    def __new_column(self, column_name: str):
+        return array("q") if self.__kind_of_column[column_name] in ("int", "coded") else []
+
+    def __encode(self, column_name: str, value):
+        # Returns what the column stores for the value, after moving the column to the object kind
+        # if its kind can't hold the value
+        column_kind = self.__kind_of_column[column_name]
+        if column_kind == "int":
+            if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+                return value
+        elif column_kind == "interned":
+            return sys.intern(value) if type(value) is str else value
+        elif column_kind == "coded":
+            try:
+                key = value_key(value)
+                code = self.__code_of_value[column_name].get(key)
+            except TypeError:
+                pass
+            else:
+                if code is None:
+                    code = len(self.__values_of_codes[column_name])
+                    self.__code_of_value[column_name][key] = code
+                    self.__values_of_codes[column_name].append(value)
+                return code
+        else:
+            return value
+        self.__to_object_column(column_name)
+        return value
+
+    def __encode_all(self, column_name: str, values: list) -> list:
+        column_kind = self.__kind_of_column[column_name]
+        if column_kind == "int" and set(map(type, values)) <= {int}:
+            try:
+                return array("q", values)
+            except OverflowError:
+                pass
+        elif column_kind == "interned":
+            return [sys.intern(value) if type(value) is str else value for value in values]
+        elif column_kind == "object":
+            return list(values)
+        elif column_kind == "coded":
+            # Rows loaded from a snapshot share the objects of their values, so a value object seen
+            # before is not keyed again
+            code_of_object = dict()
+            codes = []
+            for value in values:
+                code = code_of_object.get(id(value))
+                if code is None:
+                    code = self.__encode(column_name, value)
+                    if self.__kind_of_column[column_name] != "coded":
+                        return self.__encode_all(column_name, values)
+                    code_of_object[id(value)] = code
+                codes.append(code)
+            return codes
+        return [self.__encode(column_name, value) for value in values]
+
+    def __to_object_column(self, column_name: str):
+        self.__columns[column_name] = self.__get_values(column_name)
+        self.__kind_of_column[column_name] = "object"
+        self.__values_of_codes[column_name] = []
+        self.__code_of_value[column_name] = dict()
+
+    # --------------------- Queries ---------------------
+
+    def find_slot(self, key):
+        # Returns the slot of the row with the given key, or None if there is no such row
+        return self.__slot_of_key.get(key)
+
+    def alive_slots(self):
+        if self.__num_of_dead_slots == 0:
+            return range(len(self.__is_alive))
+        return (slot for slot, is_alive in enumerate(self.__is_alive) if is_alive)
+
+    def get_value(self, slot: int, column_name: str):
+        if self.__kind_of_column[column_name] == "coded":
+            return self.__values_of_codes[column_name][self.__columns[column_name][slot]]
+        return self.__columns[column_name][slot]
+
+    def get_derived_values(self, column_name: str, slots: list) -> list:
+        # Returns the values of a derived column in the given slots
+        derived_column = self.__derived_columns[column_name]
+        return [derived_column[slot] for slot in slots]
+
+    def get_code(self, slot: int, column_name: str):
+        # Returns the code of the row's value in a coded column, or None if the column is not coded
+        if self.__kind_of_column[column_name] != "coded":
+            return None
+        return self.__columns[column_name][slot]
+
+    def get_values_of_codes(self, column_name: str, first_code: int = 0):
+        # Returns the distinct values of a coded column indexed by their codes, starting at the given
+        # code, or None if the column is not coded. Values may belong to removed rows only.
+        if self.__kind_of_column[column_name] != "coded":
+            return None
+        return self.__values_of_codes[column_name][first_code:]
+
+    def get_column_kind(self, column_name: str) -> str:
+        return self.__kind_of_column[column_name]
+
+    def get_column_array(self, column_name: str, slots: np.ndarray = None):
+        # Returns a numpy copy of an int column's values or of a coded column's codes, one per slot
+        # including the dead ones or only in the given slots, or None for columns of other kinds
+        if self.__kind_of_column[column_name] not in ("int", "coded"):
+            return None
+        if slots is None:
+            return np.array(self.__columns[column_name], dtype=np.int64)
+        if len(self.__columns[column_name]) == 0:
+            return np.zeros(0, dtype=np.int64)
+        # Only the values in the slots are copied, the view of the whole column is dropped right away
+        # since a column can't grow while it is viewed
+        return np.frombuffer(self.__columns[column_name], dtype=np.int64)[slots]
+
+    def get_num_of_slots(self) -> int:
+        # Number of slots, alive and dead, the slots of the columns and of the alive mask run up to
+        return len(self.__is_alive)
+
+    def get_alive_mask(self) -> np.ndarray:
+        # Returns a numpy boolean array telling which slots hold a row
+        return np.frombuffer(bytes(self.__is_alive), dtype=np.bool_).copy()
+
+    def get_row(self, slot: int) -> dict:
+        return {column_name: self.get_value(slot, column_name) for column_name in self.__columns_names}
+
+    def get_columns(self) -> dict:
+        # Returns a copy of every column holding only the alive rows
+        alive_slots = None if self.__num_of_dead_slots == 0 else list(self.alive_slots())
+        return {column_name: self.__get_values(column_name, alive_slots) for column_name in self.__columns_names}
+
+    def get_derived_columns(self) -> dict:
+        # Returns a copy of every derived column holding only the alive rows
+        if self.__num_of_dead_slots == 0:
+            return {column_name: list(derived_column) for column_name, derived_column in self.__derived_columns.items()}
+        alive_slots = list(self.alive_slots())
+        return {column_name: [derived_column[slot] for slot in alive_slots]
+                for column_name, derived_column in self.__derived_columns.items()}
+
+    def get_rows(self, slots: list) -> list:
+        # Gathers the rows column by column, then zips them into one dictionary per row
+        columns_values = [self.__get_values(column_name, slots) for column_name in self.__columns_names]
+        return [dict(zip(self.__columns_names, row_values)) for row_values in zip(*columns_values)]
+
+    def get_row_series(self, slot: int) -> pd.Series:
+        row_values = [self.get_value(slot, column_name) for column_name in self.__columns_names]
+        return pd.Series(row_values, index=self.__columns_names, name=slot, dtype=object)
+
+    def to_df(self, slots: list = None) -> pd.DataFrame:
+        # Returns a DataFrame of all the stored books, or only of the books in the given slots
+        if slots is not None:
+            columns = {column_name: self.__get_values(column_name, slots) for column_name in self.__columns_names}
+            return pd.DataFrame(columns, index=slots, columns=self.__columns_names, dtype=object)
+        if self.__books_data_df is None:
+            if self.__num_of_dead_slots == 0:
+                self.__books_data_df = pd.DataFrame(self.get_columns(), columns=self.__columns_names, dtype=object)
+            else:
+                alive_slots = list(self.alive_slots())
+                alive_columns = {column_name: self.__get_values(column_name, alive_slots)
+                                 for column_name in self.__columns_names}
+                self.__books_data_df = pd.DataFrame(alive_columns, index=alive_slots,
+                                                    columns=self.__columns_names, dtype=object)
+        return self.__books_data_df
+
+    def __get_values(self, column_name: str, slots: list = None) -> list:
+        # Returns the values of the column in the given slots, or in all the slots, as a new list
+        column = self.__columns[column_name]
+        if self.__kind_of_column[column_name] == "coded":
+            values_of_codes = self.__values_of_codes[column_name]
+            if slots is None:
+                return [values_of_codes[code] for code in column]
+            return [values_of_codes[column[slot]] for slot in slots]
+        if slots is None:
+            return list(column)
+        return [column[slot] for slot in slots]
+
+    def __len__(self):
+        return len(self.__slot_of_key)
+
+
+class CodedValues:
+    # Values of a column given as every distinct value once plus the code of every row's value, in a numpy
+    # array. A coded column takes the codes as they are instead of coding every value again.
+
+    def __init__(self, values_of_codes: list, codes: np.ndarray):
+        self.__values_of_codes = values_of_codes
+        self.__codes = codes
+
+    def get_values_of_codes(self) -> list:
+        return self.__values_of_codes
+
+    def get_codes(self) -> np.ndarray:
+        return self.__codes
+
+    def __iter__(self):
+        values_of_codes = self.__values_of_codes
+        return (values_of_codes[code] for code in self.__codes.tolist())
+
+    def __len__(self):
+        return len(self.__codes)
+
+
+def value_key(value):
+    # Key telling values apart the way JSON does, so 1, 1.0 and True stay distinct values
+    if type(value) is list:
+        return list, tuple(map(type, value)), tuple(value)
+    return type(value), value
@@ -1,26 +1,102 @@
-import pandas as pd
+import json
+import os
+import uuid
+import numpy as np
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
 from Book import Book
+from BooksStorage import BooksStorage
+from BooksIndexes import SortedIndex, InvertedIndex, TrigramIndex
+from BooksSnapshot import BooksSnapshot
+from BooksStats import BooksStats
+from ReadWriteLock import ReadWriteLock
+from RequestsProfiler import span
 
 class BookStore:
-
+    # How the books' properties are kept by the storage, see BooksStorage
+    kinds_of_columns = {"id": "int", "price": "int", "year": "int", "author": "interned", "genres": "coded"}
 
     def __init__(self, genres_lst: list, range_of_valid_print_years: tuple, books_properties: list):
         self.__genres = list()
         self.__range_of_valid_print_years = tuple()
         self.__books_properties = list()
         self.__id_for_next_book = 1
+        # Bumped on every change to the catalog, so readers can tell whether cached results are stale
+        self.__version = 0
+        # Tells this store apart from the stores of other runs, the worker processes share it
+        self.__store_id = uuid.uuid4().hex[:12]
 
         self.set_genres(genres_lst)
         self.set_range_of_valid_publication_year(range_of_valid_print_years)
         self.set_books_properties(books_properties)
 
-        self.__books_data = pd.DataFrame(columns=books_properties)
+        # Every book is also kept encoded as JSON, so reads send bytes that are ready instead of encoding the books
+        self.__books_storage = BooksStorage(books_properties, kinds_of_columns=BookStore.kinds_of_columns,
+                                            derived_columns={"json": encode_book})
+        # Lowercase title -> id of the book holding it, so duplicate titles are found in O(1)
+        self.__id_of_title = dict()
+        # Secondary indexes used by get_books to avoid scanning the whole catalog
+        self.__price_index = SortedIndex()
+        self.__year_index = SortedIndex()
+        self.__genres_index = InvertedIndex()
+        self.__author_index = InvertedIndex()
+        # Books ordered by their lowercase title, so sorted results don't need to be sorted per request
+        self.__title_index = SortedIndex()
+        # Trigrams of the lowercase titles and authors, for text search
+        self.__text_index = TrigramIndex()
+        # Counts of all the books per genre, year and price, so catalog statistics are not recomputed
+        self.__books_stats = BooksStats()
+        # Every genre gets a bit, the genres of the store getting the lowest ones, and every distinct
+        # genres list stored gets the mask of its genres' bits, by its code in the storage. Genre
+        # filters test these masks instead of comparing the genres of every book.
+        self.__bit_of_genre = {genre: 1 << bit for bit, genre in enumerate(dict.fromkeys(self.__genres))}
+        self.__genres_mask_of_code = []
         self.__online_store_server = None
+        # Reads of the catalog may run together on many threads, changes run alone
+        self.__lock = ReadWriteLock()
+        # Shares the changes with the copies of the catalog held by other processes, when there are any
+        self.__change_log = None
+        self.__change_log_offset = 0
 
     # --------------------- State Changers ---------------------
 
-    def add_book(self, new_book: Book) -> str:
-        if self.is_book_in_store(new_book):
+    def add_book(self, new_book: Book) -> tuple:
+        # Returns the new book's id and an error message, with None as the id of a rejected book
+        with self.__changing():
+            error_message = self.__validate_new_book(new_book)
+            if error_message != "":
+                return None, error_message
+            new_book_properties_in_store = self.__to_book_in_store(new_book)
+            self.__apply_change({"change": "add", "books": [new_book_properties_in_store]})
+            return new_book_properties_in_store["id"], error_message
+
+    def add_books(self, new_books: list) -> list:
+        # Validates a whole batch of books, against the store and against the books before them in
+        # the batch, then adds the valid ones in a single change to the store.
+        # Returns a (new book id, error message) pair per book, with None as the id of rejected books.
+        with self.__changing():
+            results = []
+            new_books_in_store = []
+            titles_in_batch = set()
+            for new_book in new_books:
+                error_message = self.__validate_new_book(new_book, titles_in_batch)
+                if error_message == "":
+                    new_book_properties_in_store = self.__to_book_in_store(new_book)
+                    new_books_in_store.append(new_book_properties_in_store)
+                    titles_in_batch.add(new_book.title.lower())
+                    results.append((new_book_properties_in_store["id"], ""))
+                else:
+                    results.append((None, error_message))
+
+            if len(new_books_in_store) > 0:
+                self.__apply_change({"change": "add", "books": new_books_in_store})
+
+            return results
+
+    def __validate_new_book(self, new_book: Book, titles_in_batch: set = frozenset()) -> str:
+        if new_book.title.lower() in self.__id_of_title or new_book.title.lower() in titles_in_batch:
             book_title_in_store = new_book.title.lower()
             error_message = f"Error: Book with the title [{book_title_in_store}] already exists in the system"
 
@@ -32,40 +108,326 @@ class BookStore:
         elif new_book.price <= 0:
             error_message = "Error: Can’t create new Book with negative price"
 
+        elif not isinstance(new_book.genres, list) or not all(isinstance(genre, str) for genre in new_book.genres):
+            error_message = "Error: Can’t create new Book whose genres are not a list of strings"
+
         else:
-            new_book_id = self.__id_for_next_book
-            self.__id_for_next_book += 1
-            new_book_properties = new_book.get_properties()
-            new_book_properties_in_store = {"id": new_book_id}
-            # Add existing key-value pairs to the new dictionary
-            for key, value in new_book_properties.items():
-                new_book_properties_in_store[key] = value
-            self.__books_data = self.__books_data._append(new_book_properties_in_store, ignore_index=True)
             error_message = ""
 
         return error_message
 
+    def __to_book_in_store(self, new_book: Book) -> dict:
+        # Assigns the next id to the book and returns its properties as they are stored
+        new_book_id = self.__id_for_next_book
+        self.__id_for_next_book += 1
+        # The id goes first, followed by the book's own properties
+        return {"id": new_book_id, **new_book.get_properties()}
+
     def add_website(self, server):
         self.__online_store_server = server
 
     def update_book_price(self, id: int, new_price: int):
-        if new_price > 0:
-            self.__books_data.loc[self.__books_data['id'] == id, 'price'] = new_price
+        # Returns the book as it was before the update, and whether its price was updated
+        with self.__changing():
+            slot = self.__books_storage.find_slot(id)
+            if slot is None:
+                return {}, False
+            old_book = self.__books_storage.get_row(slot)
+            if new_price <= 0:
+                return old_book, False
+            self.__apply_change({"change": "update price", "id": id, "price": new_price})
+            return old_book, True
+
+    def update_books_prices(self, new_prices: list) -> list:
+        # Updates the prices of many books in a single change to the store. new_prices holds
+        # (id, new price) pairs, validated and applied in order, where None stands for a new price that
+        # is not a number. Returns, per pair, the book as it was before the update and whether its
+        # price was updated.
+        with self.__changing():
+            results = []
+            prices_updates = []
+            new_price_of_id = dict()
+            for id, new_price in new_prices:
+                slot = self.__books_storage.find_slot(id)
+                if slot is None:
+                    results.append(({}, False))
+                    continue
+                old_book = self.__books_storage.get_row(slot)
+                if id in new_price_of_id:
+                    # Updated earlier in the batch
+                    old_book["price"] = new_price_of_id[id]
+                if new_price is None or new_price <= 0:
+                    results.append((old_book, False))
+                    continue
+                new_price_of_id[id] = new_price
+                prices_updates.append([id, new_price])
+                results.append((old_book, True))
+
+            if len(prices_updates) > 0:
+                self.__apply_change({"change": "update prices", "prices": prices_updates})
+            return results
 
     def remove_book_by_id(self, id: int):
-        if self.is_book_id_in_store(id):
-            condition = self.__books_data['id'] != id
-            self.__books_data = self.__books_data[condition]
+        # Returns the removed book, whether it was removed, and the number of books left in the store,
+        # counted while no other change can run
+        with self.__changing():
+            slot = self.__books_storage.find_slot(id)
+            if slot is None:
+                return {}, False, len(self.__books_storage)
+            else:
+                removed_book = self.__books_storage.get_row(slot)
+                self.__apply_change({"change": "remove", "id": id})
+                return removed_book, True, len(self.__books_storage)
+
+    def remove_books_by_ids(self, ids: list) -> list:
+        # Removes many books in a single change to the store.
+        # Returns a (removed book, whether it was removed, number of books left after it) triple per id,
+        # counted while no other change can run.
+        with self.__changing():
+            results = []
+            removed_ids = dict()
+            num_of_books_left = len(self.__books_storage)
+            for id in ids:
+                slot = self.__books_storage.find_slot(id)
+                if slot is None or id in removed_ids:
+                    # Not in the store, or removed earlier in the batch
+                    results.append(({}, False, num_of_books_left))
+                else:
+                    num_of_books_left -= 1
+                    results.append((self.__books_storage.get_row(slot), True, num_of_books_left))
+                    removed_ids[id] = None
+
+            if len(removed_ids) > 0:
+                self.__apply_change({"change": "remove books", "ids": list(removed_ids)})
+            return results
+
+    def set_change_log(self, change_log):
+        # Restores the catalog from the latest snapshot in the change log's directory and the changes
+        # logged after it. From now on changes are appended to the change log, and changes other
+        # processes appended to it are replayed here.
+        with self.__lock.write_locked():
+            self.__change_log = change_log
+            self.__change_log_offset = change_log.get_first_offset()
+            self.__load_latest_snapshot()
+            self.__replay_change_log()
+
+    def save_snapshot(self):
+        # Snapshots the catalog, then removes the snapshots and logged changes it makes unnecessary.
+        # The catalog is only locked while it is copied, the snapshot is written afterwards.
+        with self.__change_log.writer_locked():
+            with self.__lock.write_locked():
+                self.__replay_change_log()
+            with self.__lock.read_locked():
+                properties = {"idForNextBook": self.__id_for_next_book}
+                columns = self.__books_storage.get_columns()
+                derived_columns = self.__books_storage.get_derived_columns()
+                sorted_indexes = {"title": self.__title_index.get_columns(), "price": self.__price_index.get_columns(),
+                                  "year": self.__year_index.get_columns()}
+                inverted_indexes = {"genres": self.__genres_index.get_ids_of_values(),
+                                    "author": self.__author_index.get_ids_of_values()}
+                text_index = self.__text_index.get_columns()
+                # Changes made after the copy go to a new segment of the log, replayed on top of the snapshot
+                snapshot_offset = self.__change_log.start_new_segment()
+
+        change_log_directory = self.__change_log.get_directory()
+        if os.path.exists(BooksSnapshot.get_path(change_log_directory, snapshot_offset)):
+            # Nothing changed since the last snapshot
+            return
+        BooksSnapshot.save(change_log_directory, snapshot_offset, columns, derived_columns, sorted_indexes,
+                           inverted_indexes, text_index, properties)
+        BooksSnapshot.remove_before(change_log_directory, snapshot_offset)
+        self.__change_log.remove_segments_before(snapshot_offset)
+
+    def sync_with_change_log(self):
+        # Replays the changes other processes made to the catalog since the last sync
+        if self.__change_log is None or self.__change_log.get_committed_size() == self.__change_log_offset:
+            return
+        with self.__lock.write_locked():
+            self.__replay_change_log()
+
+    @contextmanager
+    def __changing(self):
+        # Changes run alone: across processes through the change log's writer lock, and across the
+        # threads of this process through the store's lock. The catalog is brought up to date first,
+        # so the change is validated against every change made before it.
+        if self.__change_log is None:
+            with self.__lock.write_locked():
+                yield
+        else:
+            with self.__change_log.writer_locked(), self.__lock.write_locked():
+                self.__replay_change_log()
+                yield
+                changes_end_offset = self.__change_log_offset
+            # The change is only acknowledged once it is on disk, which other changes made meanwhile can share
+            self.__change_log.wait_until_durable(changes_end_offset)
+
+    def __apply_change(self, change: dict):
+        # The change is logged before it is applied, so a change that couldn't be written, for instance on
+        # a full disk, is seen neither here nor by the other processes, and a restart doesn't lose a change
+        # that was seen
+        if self.__change_log is not None:
+            self.__change_log.append(change)
+            self.__change_log_offset = self.__change_log.get_committed_size()
+        self.__replay_change(change)
+
+    def __replay_change_log(self):
+        changes, self.__change_log_offset = self.__change_log.read_changes(self.__change_log_offset)
+        if changes is None:
+            # This copy fell behind a snapshot, after which the changes it still needed were removed
+            self.__load_latest_snapshot()
+            changes, self.__change_log_offset = self.__change_log.read_changes(self.__change_log_offset)
+        for change in changes:
+            self.__replay_change(change)
+
+    def __load_latest_snapshot(self):
+        snapshot_offset, snapshot_path = BooksSnapshot.find_latest(self.__change_log.get_directory())
+        if snapshot_offset is None or snapshot_offset < self.__change_log_offset:
+            return
+        snapshot = BooksSnapshot.load(snapshot_path)
+        properties, columns, derived_columns, sorted_indexes, inverted_indexes, text_index = snapshot
+        self.__books_storage.load_columns(columns, derived_columns)
+        self.__genres_mask_of_code = []
+        self.__update_genres_masks()
+        self.__title_index.load_columns(*sorted_indexes["title"])
+        self.__price_index.load_columns(*sorted_indexes["price"])
+        self.__year_index.load_columns(*sorted_indexes["year"])
+        self.__id_of_title = dict(zip(*sorted_indexes["title"]))
+        self.__genres_index.load_ids_of_values(inverted_indexes["genres"])
+        self.__author_index.load_ids_of_values(inverted_indexes["author"])
+        if text_index is not None:
+            self.__text_index.load_columns(*text_index, num_of_ids=len(self.__books_storage))
+        else:
+            self.__build_text_index()
+        self.__books_stats = BooksStats()
+        self.__books_stats.add_counts(Counter(columns["price"]), Counter(columns["year"]),
+                                      {genre: len(ids) for genre, ids in inverted_indexes["genres"].items()})
+        self.__id_for_next_book = properties["idForNextBook"]
+        self.__change_log_offset = snapshot_offset
+        self.__version += 1
+
+    def __replay_change(self, change: dict):
+        if change["change"] == "add":
+            new_books_in_store = change["books"]
+            # The books are indexed before they are stored, and indexing checks everything that may fail
+            # before changing any index, so a book that can't be indexed leaves the catalog as it was
+            if len(new_books_in_store) == 1:
+                self.__index_book(new_books_in_store[0])
+                self.__books_storage.append(new_books_in_store[0])
+            else:
+                self.__index_books(new_books_in_store)
+                self.__books_storage.append_many(new_books_in_store)
+            self.__update_genres_masks()
+            self.__id_for_next_book = max(self.__id_for_next_book, new_books_in_store[-1]["id"] + 1)
+
+        elif change["change"] == "update price":
+            self.__update_price(change["id"], change["price"])
+
+        elif change["change"] == "update prices":
+            for id, new_price in change["prices"]:
+                self.__update_price(id, new_price)
+
+        elif change["change"] == "remove":
+            self.__remove_book(change["id"])
+
+        elif change["change"] == "remove books":
+            for id in change["ids"]:
+                self.__remove_book(id)
+
+        self.__version += 1
+
+    def __update_price(self, id: int, new_price):
+        slot = self.__books_storage.find_slot(id)
+        old_price = self.__books_storage.get_value(slot, "price")
+        self.__books_storage.set_value(slot, "price", new_price)
+        self.__price_index.remove(old_price, id)
+        self.__price_index.add(new_price, id)
+        self.__books_stats.update_price(old_price, new_price)
+
+    def __remove_book(self, id: int):
+        slot = self.__books_storage.find_slot(id)
+        removed_book = self.__books_storage.get_row(slot)
+        self.__books_storage.remove(slot)
+        self.__unindex_book(removed_book)
+
+    def __update_genres_masks(self):
+        # Adds the masks of the genres lists stored since the last update
+        new_genres_lists = self.__books_storage.get_values_of_codes("genres", len(self.__genres_mask_of_code))
+        for genres in new_genres_lists or []:
+            genres_mask = 0
+            for genre in genres:
+                genres_mask |= self.__bit_of_genre.setdefault(genre, 1 << len(self.__bit_of_genre))
+            self.__genres_mask_of_code.append(genres_mask)
+
+    def __index_book(self, book: dict):
+        id = book["id"]
+        # Both title indexes share the lowercase title
+        title_key = book["title"].lower()
+        genres = set(book["genres"])
+        author = normalize_author(book["author"])
+        search_text = get_search_text(title_key, book["author"])
+        self.__id_of_title[title_key] = id
+        self.__title_index.add(title_key, id)
+        self.__price_index.add(book["price"], id)
+        self.__year_index.add(book["year"], id)
+        for genre in genres:
+            self.__genres_index.add(genre, id)
+        self.__author_index.add(author, id)
+        self.__books_stats.add_book(book)
+        self.__text_index.add(search_text, id)
+
+    def __index_books(self, books: list):
+        # Everything derived from the books is computed before the first index changes, so a batch that
+        # can't be indexed leaves the catalog as it was
+        ids = [book["id"] for book in books]
+        titles_keys = [book["title"].lower() for book in books]
+        genres_sets = [set(book["genres"]) for book in books]
+        authors = [normalize_author(book["author"]) for book in books]
+        prices_keys = [(book["price"], id) for book, id in zip(books, ids)]
+        years_keys = [(book["year"], id) for book, id in zip(books, ids)]
+        count_of_price = Counter(book["price"] for book in books)
+        count_of_year = Counter(book["year"] for book in books)
+        count_of_genre = Counter(genre for genres in genres_sets for genre in genres)
+        text_postings = self.__text_index.get_postings([get_search_text(title_key, book["author"])
+                                                        for book, title_key in zip(books, titles_keys)], ids)
+        for id, title_key, genres, author in zip(ids, titles_keys, genres_sets, authors):
+            self.__id_of_title[title_key] = id
+            for genre in genres:
+                self.__genres_index.add(genre, id)
+            self.__author_index.add(author, id)
+        self.__books_stats.add_counts(count_of_price, count_of_year, count_of_genre)
+        self.__price_index.add_many(prices_keys)
+        self.__year_index.add_many(years_keys)
+        self.__title_index.add_many(list(zip(titles_keys, ids)))
+        self.__text_index.add_postings(text_postings, len(books))
+
+    def __unindex_book(self, book: dict):
+        id = book["id"]
+        del self.__id_of_title[book["title"].lower()]
+        self.__title_index.remove(book["title"].lower(), id)
+        self.__price_index.remove(book["price"], id)
+        self.__year_index.remove(book["year"], id)
+        for genre in set(book["genres"]):
+            self.__genres_index.remove(genre, id)
+        self.__author_index.remove(normalize_author(book["author"]), id)
+        self.__books_stats.remove_book(book)
+        self.__text_index.remove(id)
+
+    def __build_text_index(self):
+        # Indexes the text of every book stored, for snapshots saved without the text index
+        columns = self.__books_storage.get_columns()
+        self.__text_index = TrigramIndex()
+        self.__text_index.add_many([get_search_text(title.lower(), author)
+                                    for title, author in zip(columns["title"], columns["author"])], columns["id"])
 
     # --------------------- Queries ---------------------
 
     def is_book_id_in_store(self, id: int):
-        return id in self.__books_data["id"].values
+        with self.__lock.read_locked():
+            return self.__books_storage.find_slot(id) is not None
 
     def is_book_in_store(self, book: Book):
-        book_title_in_store = book.title.lower()
-        lower_case_titles = self.__books_data["title"].apply(lambda title: title.lower())
-        return book_title_in_store in lower_case_titles.values
+        with self.__lock.read_locked():
+            return book.title.lower() in self.__id_of_title
 
     def is_book_print_year_in_range(self, book: Book):
         return self.__range_of_valid_print_years[0] <= book.year <= self.__range_of_valid_print_years[1]
@@ -75,46 +437,346 @@ class BookStore:
 
     def get_books(self, author: str = None, price_bigger_than: int = None, price_less_than: int = None
                         , year_bigger_than: int = None, year_less_than: int = None, genres: list = None):
-
-        params = [author, price_bigger_than, price_less_than, year_bigger_than, year_less_than, genres]
-
-        if author != None:
-            condition_author = self.__books_data["author"].str.lower() == author.lower()  # Comparison is case-insensitive
+        # The stages of the query are timed as spans of the request when it is profiled, see RequestsProfiler
+        with self.__lock.read_locked():
+            with span("get_books: plan query"):
+                predicates = self.__plan_query(author, price_bigger_than, price_less_than
+                                               , year_bigger_than, year_less_than, genres)
+            if len(predicates) == 0:
+                with span("get_books: build data frame"):
+                    return self.__books_storage.to_df()
+            else:
+                # Keep the books in the order they are stored in, like an unfiltered query does
+                with span("get_books: combine filters"):
+                    slots = self.__find_books_slots(predicates)
+                with span("get_books: build data frame"):
+                    return self.__books_storage.to_df(slots)
+
+    def get_sorted_books(self, author: str = None, price_bigger_than: int = None, price_less_than: int = None
+                        , year_bigger_than: int = None, year_less_than: int = None, genres: list = None
+                        , after_title: str = None, offset: int = 0, limit: int = None, as_json: bool = False):
+        # Returns the requested books as a list of dictionaries, ordered by their case-insensitive title.
+        # A page of the results is returned by passing the lowercase title the previous page ended at,
+        # how many of the following books to skip, and how many books to return.
+        # With as_json, every book is given as its JSON encoding instead (see encode_book).
+        # The stages of the query are timed as spans of the request when it is profiled, see RequestsProfiler.
+        # Walking the title order filters and orders the books at once, it is timed as the page selection.
+        with self.__lock.read_locked():
+            with span("get_sorted_books: plan query"):
+                predicates = self.__plan_query(author, price_bigger_than, price_less_than
+                                               , year_bigger_than, year_less_than, genres)
+            stop = None if limit is None else offset + limit
+            slots = self.__slots_by_title(predicates, after_title, stop)
+            with span("get_sorted_books: select page"):
+                page_slots = list(islice(slots, offset, stop))
+            with span("get_sorted_books: fetch books"):
+                return self.__get_books(page_slots, as_json)
+
+    def get_sorted_books_ids(self, author: str = None, price_bigger_than: int = None, price_less_than: int = None
+                             , year_bigger_than: int = None, year_less_than: int = None, genres: list = None
+                             , after_title: str = None, offset: int = 0, limit: int = None) -> np.ndarray:
+        # Returns the ids of the books get_sorted_books returns, in the same order, as a numpy array.
+        # Ids stay valid while the catalog changes, so the books can be read later on, a part at a time.
+        with self.__lock.read_locked():
+            predicates = self.__plan_query(author, price_bigger_than, price_less_than
+                                           , year_bigger_than, year_less_than, genres)
+            stop = None if limit is None else offset + limit
+            slots = self.__slots_by_title(predicates, after_title, stop)
+            return self.__books_storage.get_column_array("id", np.fromiter(islice(slots, offset, stop), dtype=np.int64))
+
+    def __get_books(self, slots: list, as_json: bool) -> list:
+        if as_json:
+            return self.__books_storage.get_derived_values("json", slots)
+        return self.__books_storage.get_rows(slots)
+
+    def __slots_by_title(self, predicates: list, after_title: str = None, num_of_slots: int = None):
+        # Yields the slots of the books matching all the predicates, in title order.
+        # num_of_slots is how many of them the caller takes at most, when it is known.
+        storage = self.__books_storage
+        if len(predicates) == 0:
+            return (storage.find_slot(id) for id in self.__title_index.ids_after(after_title))
+        elif not self.__is_selective(predicates):
+            # Most of the catalog matches, walking the title order is cheaper than sorting the matches.
+            # Only the few books of a page are checked one by one, otherwise all of them are checked at once.
+            slots = (storage.find_slot(id) for id in self.__title_index.ids_after(after_title))
+            if num_of_slots is not None and num_of_slots * 8 < len(storage):
+                return (slot for slot in slots if all(predicate[2](slot) for predicate in predicates))
+            with span("get_sorted_books: combine filters"):
+                is_matching_slot = self.__rows_mask(predicates).tobytes()
+            return (slot for slot in slots if is_matching_slot[slot])
         else:
-            condition_author = None
-        condition_price_bigger_than = self.__books_data["price"] >= price_bigger_than
-        condition_price_less_than = self.__books_data["price"] <= price_less_than
-        condition_year_bigger_than = self.__books_data["year"] >= year_bigger_than
-        condition_year_less_than = self.__books_data["year"] <= year_less_than
-        condition_genres = self.__books_data["genres"].apply(lambda book_genres: genres is not None and not set(genres).isdisjoint(book_genres))
-
-        all_conditions = [condition_author, condition_price_bigger_than, condition_price_less_than
-                          , condition_year_bigger_than, condition_year_less_than, condition_genres]
-        requested_conditions = []
-        for i in range(len(params)):
-            if params[i] is not None:
-                requested_conditions.append(all_conditions[i])
-
-        if len(requested_conditions) == 0:
-            return self.__books_data
+            with span("get_sorted_books: combine filters"):
+                slots = [storage.find_slot(id) for id in self.__run_query_plan(predicates)]
+            with span("get_sorted_books: sort by title"):
+                titles_and_slots = sorted((storage.get_value(slot, "title").lower(), slot) for slot in slots)
+            if after_title is not None:
+                titles_and_slots = titles_and_slots[bisect_right(titles_and_slots, (after_title, float("inf"))):]
+            return (slot for title, slot in titles_and_slots)
+
+    def search_books(self, query: str, after_title: str = None, offset: int = 0, limit: int = None,
+                     as_json: bool = False):
+        # Returns the books whose title or author contains the query, case-insensitively, as a list of
+        # dictionaries ordered by their case-insensitive title. Pages and JSON encoded books are
+        # requested like in get_sorted_books.
+        with self.__lock.read_locked():
+            stop = None if limit is None else offset + limit
+            slots = self.__search_slots_by_title(query.lower(), after_title)
+            return self.__get_books(list(islice(slots, offset, stop)), as_json)
+
+    def __search_slots_by_title(self, query: str, after_title: str = None):
+        # Yields the slots of the books whose lowercase title or author contains the lowercase query, in
+        # title order. Like __slots_by_title, the title order is walked checking every book when most books
+        # may match. Otherwise only the candidates found through the trigrams are checked: a few of them are
+        # sorted by title, and many of them are picked out of the title order buckets of ids at a time,
+        # which costs little per book walked and lets a page stop the walk early.
+        storage = self.__books_storage
+
+        def matches(slot):
+            return (query in storage.get_value(slot, "title").lower()
+                    or query in (normalize_author(storage.get_value(slot, "author")) or ""))
+
+        if self.__text_index.count_candidates(query) * 8 >= len(storage):
+            slots = (storage.find_slot(id) for id in self.__title_index.ids_after(after_title))
+            return (slot for slot in slots if matches(slot))
+        candidates = self.__text_index.get_candidates(query)
+        # Sorting a candidate costs about as much as walking 512 books of the title order
+        if len(candidates) * 512 < len(storage):
+            return self.__sort_candidates(candidates, matches, after_title)
+        return self.__walk_candidates(candidates, matches, after_title)
+
+    def __walk_candidates(self, candidates, matches, after_title: str = None):
+        storage = self.__books_storage
+        # Flags the candidates by id, ids are never given twice so every id stored has a flag
+        is_candidate = np.zeros(self.__id_for_next_book, dtype=np.bool_)
+        is_candidate[candidates] = True
+        ids_chunks = self.__title_index.ids_chunks_after(after_title)
+        while True:
+            # Buckets are walked a few at a time, so numpy works on thousands of ids per call
+            ids_chunks_group = list(islice(ids_chunks, 16))
+            if len(ids_chunks_group) == 0:
+                return
+            ids = np.frombuffer(b"".join(ids_chunks_group), dtype=np.int64)
+            for id in ids[is_candidate[ids]].tolist():
+                slot = storage.find_slot(id)
+                if matches(slot):
+                    yield slot
+
+    def __sort_candidates(self, candidates, matches, after_title: str = None):
+        storage = self.__books_storage
+        slots = [storage.find_slot(id) for id in candidates.tolist()]
+        titles_and_slots = sorted((storage.get_value(slot, "title").lower(), slot)
+                                  for slot in slots if slot is not None and matches(slot))
+        if after_title is not None:
+            titles_and_slots = titles_and_slots[bisect_right(titles_and_slots, (after_title, float("inf"))):]
+        return (slot for title, slot in titles_and_slots)
+
+    def count_books(self, author: str = None, price_bigger_than: int = None, price_less_than: int = None
+                        , year_bigger_than: int = None, year_less_than: int = None, genres: list = None):
+        with self.__lock.read_locked():
+            predicates = self.__plan_query(author, price_bigger_than, price_less_than
+                                           , year_bigger_than, year_less_than, genres)
+            if len(predicates) == 0:
+                return len(self.__books_storage)
+            elif self.__is_selective(predicates):
+                return len(self.__run_query_plan(predicates))
+            else:
+                return int(np.count_nonzero(self.__rows_mask(predicates)))
+
+    def get_books_stats(self, author: str = None, price_bigger_than: int = None, price_less_than: int = None
+                        , year_bigger_than: int = None, year_less_than: int = None, genres: list = None) -> dict:
+        # Returns how many books there are per genre, publication year and price bucket, and their
+        # lowest, highest and mean price, for the whole catalog or for the books matching the filters
+        with self.__lock.read_locked():
+            predicates = self.__plan_query(author, price_bigger_than, price_less_than
+                                           , year_bigger_than, year_less_than, genres)
+            if len(predicates) == 0:
+                return self.__books_stats.to_dict(self.__genres)
+            # Finding the slot of an id costs about as much as checking a few hundred slots at once, so
+            # unlike other queries only a very selective one lists its books through the indexes
+            if predicates[0][0] * 256 < len(self.__books_storage):
+                slots = np.array([self.__books_storage.find_slot(id) for id in self.__run_query_plan(predicates)],
+                                 dtype=np.int64)
+            else:
+                slots = np.flatnonzero(self.__rows_mask(predicates))
+            books_stats = BooksStats()
+            books_stats.add_counts(*self.__count_values(slots))
+            return books_stats.to_dict(self.__genres)
+
+    def __count_values(self, slots: np.ndarray) -> tuple:
+        # Returns the count per price, per year and per genre of the books in the slots. Columns of ints
+        # and of coded genres lists are counted with numpy, the codes of the lists before their genres.
+        storage = self.__books_storage
+        counts_of_values = []
+        for column_name in ("price", "year"):
+            if storage.get_column_kind(column_name) == "int" and len(slots) > 0:
+                values = storage.get_column_array(column_name, slots)
+                lowest_value = int(values.min())
+                if int(values.max()) - lowest_value <= 4 * len(values):
+                    counts = np.bincount(values - lowest_value)
+                    values = np.flatnonzero(counts)
+                    counts, values = counts[values], values + lowest_value
+                else:
+                    values, counts = np.unique(values, return_counts=True)
+                counts_of_values.append(dict(zip(values.tolist(), counts.tolist())))
+            else:
+                counts_of_values.append(Counter(storage.get_value(slot, column_name) for slot in slots.tolist()))
+
+        count_of_genre = Counter()
+        if storage.get_column_kind("genres") == "coded":
+            genres_codes = storage.get_column_array("genres", slots)
+            values_of_codes = storage.get_values_of_codes("genres")
+            for code, count in enumerate(np.bincount(genres_codes, minlength=1).tolist()):
+                if count > 0:
+                    for genre in set(values_of_codes[code]):
+                        count_of_genre[genre] += count
         else:
-            # Combine all conditions using the AND operator
-            combined_requested_conditions = requested_conditions[0]
-            for condition in requested_conditions[1:]:
-                combined_requested_conditions &= condition
-
-            return self.__books_data[combined_requested_conditions]
+            for slot in slots.tolist():
+                count_of_genre.update(set(storage.get_value(slot, "genres")))
+        return counts_of_values[0], counts_of_values[1], count_of_genre
+
+    def __find_books_slots(self, predicates: list) -> list:
+        # Returns the slots of the books matching all the predicates, in increasing order
+        if self.__is_selective(predicates):
+            return sorted(self.__books_storage.find_slot(id) for id in self.__run_query_plan(predicates))
+        return np.flatnonzero(self.__rows_mask(predicates)).tolist()
+
+    def __plan_query(self, author, price_bigger_than, price_less_than, year_bigger_than, year_less_than, genres):
+        # Query planner: every requested filter becomes a predicate that knows how many books it
+        # matches, how to list them from its index, how to check a single book, and how to check
+        # every slot at once (as a numpy boolean array over the slots).
+        # Predicates are returned from the most selective to the least selective one.
+        storage = self.__books_storage
+        predicates = []
+
+        if author is not None:
+            author_key = normalize_author(author)  # Comparison is case-insensitive
+            predicates.append((self.__author_index.count(author_key),
+                               lambda: self.__author_index.get_ids(author_key),
+                               lambda slot: normalize_author(storage.get_value(slot, "author")) == author_key,
+                               lambda: self.__rows_mask_of_ids(self.__author_index.get_ids(author_key))))
+
+        if price_bigger_than is not None or price_less_than is not None:
+            predicates.append(self.__range_predicate(self.__price_index, "price", price_bigger_than, price_less_than))
+
+        if year_bigger_than is not None or year_less_than is not None:
+            predicates.append(self.__range_predicate(self.__year_index, "year", year_bigger_than, year_less_than))
+
+        if genres is not None:
+            predicates.append(self.__genres_predicate(set(genres)))
+
+        predicates.sort(key=lambda predicate: predicate[0])
+        return predicates
+
+    def __is_selective(self, predicates: list) -> bool:
+        # Whether the most selective predicate leaves few enough books to check the others on them one
+        # by one, rather than checking whole columns at once
+        return predicates[0][0] * 8 < len(self.__books_storage)
+
+    def __run_query_plan(self, predicates: list) -> list:
+        # The ids of the most selective predicate are listed, and the rest are checked on them only
+        storage = self.__books_storage
+        books_ids = predicates[0][1]()
+        other_predicates = [predicate[2] for predicate in predicates[1:]]
+        if len(other_predicates) == 0:
+            return list(books_ids)
+        return [id for id in books_ids
+                if all(matches(storage.find_slot(id)) for matches in other_predicates)]
+
+    def __rows_mask(self, predicates: list) -> np.ndarray:
+        # Returns a boolean array telling which slots hold a book matching all the predicates
+        rows_mask = self.__books_storage.get_alive_mask()
+        for predicate in predicates:
+            rows_mask &= predicate[3]()
+        return rows_mask
+
+    def __rows_mask_of_ids(self, ids) -> np.ndarray:
+        storage = self.__books_storage
+        rows_mask = np.zeros(storage.get_num_of_slots(), dtype=np.bool_)
+        rows_mask[[storage.find_slot(id) for id in ids]] = True
+        return rows_mask
+
+    def __range_predicate(self, index: SortedIndex, column_name: str, lowest_value, highest_value):
+        storage = self.__books_storage
+
+        def matches(slot):
+            value = storage.get_value(slot, column_name)
+            return ((lowest_value is None or value >= lowest_value)
+                    and (highest_value is None or value <= highest_value))
+
+        def rows_mask():
+            values = storage.get_column_array(column_name)
+            if values is None:
+                return self.__rows_mask_of_ids(index.ids_in_range(lowest_value, highest_value))
+            rows_mask = np.ones(len(values), dtype=np.bool_)
+            if lowest_value is not None:
+                rows_mask &= values >= lowest_value
+            if highest_value is not None:
+                rows_mask &= values <= highest_value
+            return rows_mask
+
+        return (index.count_in_range(lowest_value, highest_value),
+                lambda: index.ids_in_range(lowest_value, highest_value),
+                matches,
+                rows_mask)
+
+    def __genres_predicate(self, requested_genres: set):
+        # Books having any of the requested genres. The requested genres become a mask of their bits,
+        # and a genres list matches when its mask shares a bit with it.
+        storage = self.__books_storage
+        genres_index = self.__genres_index
+        genres_mask_of_code = self.__genres_mask_of_code
+        requested_genres_mask = 0
+        for genre in requested_genres:
+            requested_genres_mask |= self.__bit_of_genre.get(genre, 0)
+
+        if storage.get_column_kind("genres") == "coded":
+            def matches(slot):
+                return (genres_mask_of_code[storage.get_code(slot, "genres")] & requested_genres_mask) != 0
+
+            def rows_mask():
+                is_matching_code = np.array([(genres_mask & requested_genres_mask) != 0
+                                             for genres_mask in genres_mask_of_code], dtype=np.bool_)
+                return is_matching_code[storage.get_column_array("genres")]
+        else:
+            def matches(slot):
+                return not requested_genres.isdisjoint(storage.get_value(slot, "genres"))
+
+            def rows_mask():
+                return self.__rows_mask_of_ids(set().union(*(genres_index.get_ids(genre) for genre in requested_genres)))
+
+        return (sum(genres_index.count(genre) for genre in requested_genres),
+                lambda: set().union(*(genres_index.get_ids(genre) for genre in requested_genres)),
+                matches,
+                rows_mask)
+
+    def get_books_by_ids(self, ids: list, as_json: bool = False) -> list:
+        # Returns a (book dictionary, whether it was found) pair per id, all read at the same state of the catalog.
+        # With as_json, the books found are given as their JSON encoding instead.
+        with self.__lock.read_locked():
+            storage = self.__books_storage
+            slots = [storage.find_slot(id) for id in ids]
+            found_books = iter(self.__get_books([slot for slot in slots if slot is not None], as_json))
+            return [({}, False) if slot is None else (next(found_books), True) for slot in slots]
+
+    def get_encoded_book(self, id: int) -> tuple:
+        # Returns the JSON encoding of the book and its version (see get_book_version), or (None, None)
+        # if there is no such book
+        with self.__lock.read_locked():
+            slot = self.__books_storage.find_slot(id)
+            if slot is None:
+                return None, None
+            book_version = self.get_book_version({"id": id, "price": self.__books_storage.get_value(slot, "price")})
+            return self.__books_storage.get_derived_values("json", [slot])[0], book_version
 
     def get_book_by_id(self, id: int, as_dict=False):
-        books_df = self.__books_data
-        condition = books_df["id"] == id
-        book_with_id_df = books_df[condition]
-        if book_with_id_df.empty:
-            return {}, False
-        elif as_dict is True:
-            return book_with_id_df.iloc[0].to_dict(), True
-        else:
-            return book_with_id_df.iloc[0], True
+        with self.__lock.read_locked():
+            slot = self.__books_storage.find_slot(id)
+            if slot is None:
+                return {}, False
+            elif as_dict is True:
+                return self.__books_storage.get_row(slot), True
+            else:
+                return self.__books_storage.get_row_series(slot), True
 
     # --------------------- Setters ---------------------
     def set_genres(self, genres_lst: list):
@@ -140,12 +802,58 @@ class BookStore:
     # --------------------- Getters ---------------------
 
     def get_books_data_df(self):
-        return self.__books_data
+        with self.__lock.read_locked():
+            return self.__books_storage.to_df()
 
     def get_num_of_books(self):
-        return len(self.__books_data)
+        with self.__lock.read_locked():
+            return len(self.__books_storage)
+
+    def get_indexes_sizes(self) -> dict:
+        # Number of keys in every sorted index, number of distinct values in every inverted index, and
+        # number of distinct trigrams in the search index
+        with self.__lock.read_locked():
+            return {"title": len(self.__title_index), "price": len(self.__price_index), "year": len(self.__year_index),
+                    "genres": len(self.__genres_index), "author": len(self.__author_index),
+                    "search": len(self.__text_index)}
 
     def get_genres(self):
         return list(self.__genres)
 
+    def get_version(self):
+        return self.__version
+
+    def get_store_id(self) -> str:
+        return self.__store_id
+
+    def get_state_position(self) -> int:
+        # Position of the catalog's current state among the states it went through. It is the offset in
+        # the change log when there is one, so all the worker processes name a state the same way, and
+        # the version otherwise.
+        with self.__lock.read_locked():
+            return self.__version if self.__change_log is None else self.__change_log_offset
+
+    def get_book_version(self, book: dict) -> str:
+        # Ids are never given twice, and a book only changes through its price, so the two of them
+        # tell apart every version of a book
+        return f"{book['id']}.{book['price']}"
+
+
+def normalize_author(author) -> str:
+    # Authors are matched case-insensitively, and values that are not strings never match a name
+    return author.lower() if isinstance(author, str) else None
+
+
+def encode_book(book: dict) -> bytes:
+    # The JSON encoding of a book the way the server's JSON provider encodes it: compact, with sorted keys
+    # and ASCII only, so encoded books can be sent within responses the provider encodes
+    return book_encoder.encode(book).encode("ascii")
+
+
+book_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
 
+def get_search_text(title_key: str, author) -> str:
+    # The text of a book searched for a query: its lowercase title and author, joined by a separator
+    # that queries don't hold, so a query never matches across the two
+    return f"{title_key}\x00{normalize_author(author) or ''}"
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import threading
+
+
+class QueryCache:
+    # Bounded LRU cache of query results.
+    # Every entry remembers the store version it was computed at, and is only served while the
+    # store is still at that version, so any change to the catalog invalidates older results.
+    # All operations take an internal lock, so the cache can be shared by request threads.
+
+    def __init__(self, capacity: int):
+        self.__capacity = capacity
+        self.__entries = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key, version: int):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.__entries.move_to_end(key)
+                self.__hits += 1
+                return entry[1], True
+            if entry is not None:
+                del self.__entries[key]
+            self.__misses += 1
+            return None, False
+
+    def put(self, key, version: int, value):
+        with self.__lock:
+            existing_entry = self.__entries.get(key)
+            if self.__capacity <= 0 or (existing_entry is not None and existing_entry[0] > version):
+                # A request that computed its result before the last change must not replace a newer one
+                return
+            self.__entries[key] = (version, value)
+            self.__entries.move_to_end(key)
+            if len(self.__entries) > self.__capacity:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+
+    def get_stats(self) -> dict:
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {"hits": self.__hits, "misses": self.__misses, "evictions": self.__evictions,
+                    "hitRate": self.__hits / lookups if lookups > 0 else 0.0,
+                    "size": len(self.__entries), "capacity": self.__capacity}
+
+
+class StateBytesCache:
+    # LRU cache of byte strings made at the latest state of the store, bounded by their total size.
+    # States only move forward, so every entry is dropped as soon as a newer state is seen, and values
+    # larger than max_value_size are not kept at all.
+    # All operations take an internal lock, so the cache can be shared by request threads.
+
+    def __init__(self, capacity_in_bytes: int, max_value_size: int):
+        self.__capacity_in_bytes = capacity_in_bytes
+        self.__max_value_size = max_value_size
+        self.__entries = OrderedDict()
+        self.__state = None
+        self.__size_in_bytes = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key, state: int):
+        # Returns the (value, extra) pair kept for the key at the given state, or None
+        with self.__lock:
+            self.__move_to_state(state)
+            if state != self.__state or key not in self.__entries:
+                return None
+            self.__entries.move_to_end(key)
+            return self.__entries[key]
+
+    def put(self, key, state: int, value: bytes, extra=None):
+        # extra is kept and returned along with the value, without counting towards the size
+        with self.__lock:
+            self.__move_to_state(state)
+            if state != self.__state or len(value) > self.__max_value_size or key in self.__entries:
+                # Made at a state older than the cache's, or too large to be worth its space
+                return
+            self.__entries[key] = (value, extra)
+            self.__size_in_bytes += len(value)
+            while self.__size_in_bytes > self.__capacity_in_bytes:
+                _, (evicted_value, _) = self.__entries.popitem(last=False)
+                self.__size_in_bytes -= len(evicted_value)
+
+    def __move_to_state(self, state: int):
+        if self.__state is None or state > self.__state:
+            self.__entries.clear()
+            self.__size_in_bytes = 0
+            self.__state = state
@@ -0,0 +1,97 @@
+import logging
+import os
+import queue
+import threading
+
+
+class QueueLogHandler(logging.Handler):
+    # Hands log records to a background writer thread through a bounded queue, so request threads
+    # never wait on files or the console.
+    # The message of a record is only formatted by the writer thread, and the writer flushes every
+    # target handler once per batch of records instead of once per record.
+    # When the queue is full, records are dropped (and counted) or the logging thread waits for
+    # room, depending on the overflow policy.
+
+    overflow_policies = ("drop", "block")
+    max_batch_size = 512
+
+    def __init__(self, target_handlers: list, capacity: int = 10000, overflow_policy: str = "drop"):
+        super().__init__()
+        if overflow_policy not in QueueLogHandler.overflow_policies:
+            raise ValueError(f"Error: overflow policy must be one of {QueueLogHandler.overflow_policies}")
+        self.__target_handlers = list(target_handlers)
+        self.__capacity = capacity
+        self.__overflow_policy = overflow_policy
+        self.__num_of_dropped_records = 0
+        self.__start_writer()
+        # A forked process only inherits the thread that forked it, so it starts a writer of its own
+        os.register_at_fork(after_in_child=self.__start_writer)
+
+    def __start_writer(self):
+        self.__records = queue.Queue(self.__capacity)
+        self.__writer = threading.Thread(target=self.__write_records, name="log-writer", daemon=True)
+        self.__writer.start()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.__overflow_policy == "block":
+                self.__records.put(record)
+            else:
+                self.__records.put_nowait(record)
+        except queue.Full:
+            self.__num_of_dropped_records += 1
+
+    def get_num_of_dropped_records(self) -> int:
+        return self.__num_of_dropped_records
+
+    def flush(self):
+        # Waits until every record queued so far was written
+        if self.__writer.is_alive():
+            self.__records.join()
+
+    def close(self):
+        if self.__writer.is_alive():
+            self.__records.put(None)
+            self.__writer.join()
+        for target_handler in self.__target_handlers:
+            target_handler.close()
+        super().close()
+
+    # --------------------- Writer Thread ---------------------
+
+    def __write_records(self):
+        records = self.__records
+        while True:
+            batch = [records.get()]
+            while len(batch) < QueueLogHandler.max_batch_size:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            is_closing = batch[-1] is None
+            if is_closing:
+                batch.pop()
+            self.__write_batch(batch)
+            for _ in range(len(batch) + is_closing):
+                records.task_done()
+            if is_closing:
+                return
+
+    def __write_batch(self, batch: list):
+        for target_handler in self.__target_handlers:
+            stream = getattr(target_handler, "stream", None)
+            target_handler.acquire()
+            try:
+                for record in batch:
+                    if record.levelno < target_handler.level:
+                        continue
+                    try:
+                        if stream is None:
+                            target_handler.emit(record)
+                        else:
+                            stream.write(target_handler.format(record) + target_handler.terminator)
+                    except Exception:
+                        target_handler.handleError(record)
+                target_handler.flush()
+            finally:
+                target_handler.release()
@@ -0,0 +1,43 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    # Lets any number of readers hold the lock together, or a single writer alone.
+    # Waiting writers go before new readers, so a steady stream of reads can't starve the writes.
+    # The lock is not reentrant: code holding it must not try to take it again.
+
+    def __init__(self):
+        self.__condition = threading.Condition(threading.Lock())
+        self.__num_of_readers = 0
+        self.__num_of_waiting_writers = 0
+        self.__is_writer_active = False
+
+    @contextmanager
+    def read_locked(self):
+        with self.__condition:
+            while self.__is_writer_active or self.__num_of_waiting_writers > 0:
+                self.__condition.wait()
+            self.__num_of_readers += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__num_of_readers -= 1
+                if self.__num_of_readers == 0:
+                    self.__condition.notify_all()
+
+    @contextmanager
+    def write_locked(self):
+        with self.__condition:
+            self.__num_of_waiting_writers += 1
+            while self.__is_writer_active or self.__num_of_readers > 0:
+                self.__condition.wait()
+            self.__num_of_waiting_writers -= 1
+            self.__is_writer_active = True
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__is_writer_active = False
+                self.__condition.notify_all()
@@ -0,0 +1,91 @@
+import multiprocessing
+from bisect import bisect_left
+
+
+class RequestsMetrics:
+    # Latency histograms, request counters and in-flight gauges per endpoint (route + verb) and status.
+    # Every series has a fixed slot in shared memory, so the worker processes forked after the metrics
+    # were created all count into the same numbers, and recording a request is a few array updates.
+    # Statuses outside of known_statuses are counted together under the "other" status.
+
+    # Upper bounds of the latency buckets, in seconds
+    buckets_bounds = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    known_statuses = (200, 304, 400, 404, 405, 409, 500)
+    unmatched_route = "unmatched"
+
+    def __init__(self, endpoints: list):
+        # endpoints: (route, verb) pairs. Requests not matching any of them are counted under the
+        # unmatched route with their verb replaced by "ANY".
+        self.__endpoints = list(endpoints) + [(RequestsMetrics.unmatched_route, "ANY")]
+        self.__index_of_endpoint = {endpoint: index for index, endpoint in enumerate(self.__endpoints)}
+        self.__statuses = [str(status) for status in RequestsMetrics.known_statuses] + ["other"]
+        self.__index_of_status = {status: index for index, status in enumerate(RequestsMetrics.known_statuses)}
+        num_of_series = len(self.__endpoints) * len(self.__statuses)
+        # Every series has a count per bucket, with one more bucket for the durations above all bounds
+        self.__num_of_buckets = len(RequestsMetrics.buckets_bounds) + 1
+        self.__buckets_counts = multiprocessing.RawArray("q", num_of_series * self.__num_of_buckets)
+        self.__durations_sums = multiprocessing.RawArray("d", num_of_series)
+        self.__in_flight = multiprocessing.RawArray("q", len(self.__endpoints))
+        self.__lock = multiprocessing.Lock()
+
+    # --------------------- State Changers ---------------------
+
+    def get_endpoint(self, route: str, verb: str) -> int:
+        # Returns the index of the endpoint, which the other methods take
+        return self.__index_of_endpoint.get((route, verb), len(self.__endpoints) - 1)
+
+    def start_request(self, endpoint: int):
+        with self.__lock:
+            self.__in_flight[endpoint] += 1
+
+    def end_request(self, endpoint: int):
+        with self.__lock:
+            self.__in_flight[endpoint] -= 1
+
+    def observe(self, endpoint: int, status: int, duration: float):
+        status_index = self.__index_of_status.get(status, len(self.__statuses) - 1)
+        series = endpoint * len(self.__statuses) + status_index
+        bucket = bisect_left(RequestsMetrics.buckets_bounds, duration)
+        with self.__lock:
+            self.__buckets_counts[series * self.__num_of_buckets + bucket] += 1
+            self.__durations_sums[series] += duration
+
+    # --------------------- Queries ---------------------
+
+    def to_prometheus_lines(self, prefix: str) -> list:
+        # Returns the metrics in the Prometheus text exposition format, one line per item
+        with self.__lock:
+            buckets_counts = self.__buckets_counts[:]
+            durations_sums = self.__durations_sums[:]
+            in_flight = self.__in_flight[:]
+
+        duration_lines = [f"# HELP {prefix}_request_duration_seconds Time spent handling requests.",
+                          f"# TYPE {prefix}_request_duration_seconds histogram"]
+        requests_lines = [f"# HELP {prefix}_requests_total Requests handled.",
+                          f"# TYPE {prefix}_requests_total counter"]
+        for endpoint_index, (route, verb) in enumerate(self.__endpoints):
+            for status_index, status in enumerate(self.__statuses):
+                series = endpoint_index * len(self.__statuses) + status_index
+                series_buckets_counts = buckets_counts[series * self.__num_of_buckets:(series + 1) * self.__num_of_buckets]
+                count = sum(series_buckets_counts)
+                if count == 0:
+                    continue
+                labels = f'route="{escape_label_value(route)}",method="{verb}",status="{status}"'
+                cumulative_count = 0
+                for bound, bucket_count in zip(RequestsMetrics.buckets_bounds, series_buckets_counts):
+                    cumulative_count += bucket_count
+                    duration_lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative_count}')
+                duration_lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                duration_lines.append(f"{prefix}_request_duration_seconds_sum{{{labels}}} {durations_sums[series]}")
+                duration_lines.append(f"{prefix}_request_duration_seconds_count{{{labels}}} {count}")
+                requests_lines.append(f"{prefix}_requests_total{{{labels}}} {count}")
+
+        in_flight_lines = [f"# HELP {prefix}_requests_in_flight Requests being handled right now.",
+                           f"# TYPE {prefix}_requests_in_flight gauge"]
+        for (route, verb), endpoint_in_flight in zip(self.__endpoints, in_flight):
+            in_flight_lines.append(f'{prefix}_requests_in_flight{{route="{escape_label_value(route)}",method="{verb}"}} {endpoint_in_flight}')
+        return duration_lines + requests_lines + in_flight_lines
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
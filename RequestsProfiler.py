@@ -0,0 +1,141 @@
+import cProfile
+import multiprocessing
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class RequestsProfiler:
+    # Opt-in profiling of the requests handled by a WSGI app. A sampled share of the requests, and every
+    # request sent with the profiling header set to true, run under cProfile, and the time they spend in
+    # named spans (see span) is measured. Both are aggregated until reset, and reported as the functions
+    # most of the time went to and the time spent per span.
+    # When a request is not profiled it costs a random draw, and every span it goes through a thread-local
+    # lookup. The sample rate lives in shared memory, so setting it applies to all the worker processes
+    # forked after the profiler was created, while every worker reports the requests it profiled itself.
+    # cProfile runs for one request at a time, the requests sampled meanwhile only measure their spans.
+
+    header_name = "X-Profile-Request"
+    # Key of the profiling header in the WSGI environ
+    header_environ_key = "HTTP_" + header_name.upper().replace("-", "_")
+    sort_keys = {"own-time": "tottime", "total-time": "cumulative", "calls": "ncalls"}
+
+    def __init__(self, sample_rate: float = 0.0):
+        self.__sample_rate = multiprocessing.RawValue("d", sample_rate)
+        self.__stats = None
+        self.__num_of_profiled_requests = 0
+        # Span name -> [requests that went through it, seconds spent in it, most seconds a request spent in it]
+        self.__span_stats = dict()
+        self.__lock = threading.Lock()
+        self.__profiler_lock = threading.Lock()
+
+    # --------------------- State Changers ---------------------
+
+    def wrap(self, wsgi_app):
+        # Returns a WSGI app handling requests with the given one, profiling the requests sampled
+        def profiled_wsgi_app(environ, start_response):
+            if not self.__is_profiled(environ):
+                return wsgi_app(environ, start_response)
+            return self.__profile(wsgi_app, environ, start_response)
+        return profiled_wsgi_app
+
+    def set_sample_rate(self, sample_rate: float):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("The sample rate must be between 0 and 1.")
+        self.__sample_rate.value = sample_rate
+
+    def reset(self):
+        with self.__lock:
+            self.__stats = None
+            self.__num_of_profiled_requests = 0
+            self.__span_stats = dict()
+
+    def __is_profiled(self, environ: dict) -> bool:
+        sample_rate = self.__sample_rate.value
+        return ((sample_rate > 0 and random.random() < sample_rate)
+                or environ.get(RequestsProfiler.header_environ_key, "").lower() == "true")
+
+    def __profile(self, wsgi_app, environ, start_response):
+        profiler = cProfile.Profile() if self.__profiler_lock.acquire(blocking=False) else None
+        spans_durations = dict()
+        profiled_request_state.spans_durations = spans_durations
+        start_time = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            spans_durations["request"] = time.perf_counter() - start_time
+            profiled_request_state.spans_durations = None
+            if profiler is not None:
+                self.__profiler_lock.release()
+            self.__record(profiler, spans_durations)
+
+    def __record(self, profiler, spans_durations: dict):
+        with self.__lock:
+            self.__num_of_profiled_requests += 1
+            for span_name, duration in spans_durations.items():
+                span_stats = self.__span_stats.setdefault(span_name, [0, 0.0, 0.0])
+                span_stats[0] += 1
+                span_stats[1] += duration
+                span_stats[2] = max(span_stats[2], duration)
+            if profiler is not None:
+                if self.__stats is None:
+                    self.__stats = pstats.Stats(profiler)
+                else:
+                    self.__stats.add(profiler)
+
+    # --------------------- Queries ---------------------
+
+    def get_sample_rate(self) -> float:
+        return self.__sample_rate.value
+
+    def get_report(self, sort_by: str = "own-time", num_of_functions: int = 30) -> dict:
+        # Returns the spans, and the num_of_functions functions first by sort_by (one of sort_keys), of the
+        # requests profiled since the last reset. Times are in milliseconds.
+        with self.__lock:
+            spans = {span_name: {"requests": num_of_requests, "totalMs": total_duration * 1e3,
+                                 "meanMs": total_duration / num_of_requests * 1e3, "maxMs": max_duration * 1e3}
+                     for span_name, (num_of_requests, total_duration, max_duration) in self.__span_stats.items()}
+            functions = []
+            if self.__stats is not None:
+                self.__stats.sort_stats(RequestsProfiler.sort_keys[sort_by])
+                for function in self.__stats.fcn_list[:num_of_functions]:
+                    _, num_of_calls, own_time, total_time, _ = self.__stats.stats[function]
+                    functions.append({"function": pstats.func_std_string(function), "calls": num_of_calls,
+                                      "ownTimeMs": own_time * 1e3, "totalTimeMs": total_time * 1e3})
+            return {"sampleRate": self.__sample_rate.value, "profiledRequests": self.__num_of_profiled_requests,
+                    "spans": spans, "hotSpots": functions}
+
+
+class ProfiledRequestState(threading.local):
+    # Spans measured by the request the current thread handles, None when it is not profiled
+    spans_durations = None
+
+
+profiled_request_state = ProfiledRequestState()
+no_span = nullcontext()
+
+
+def span(span_name: str):
+    # Returns a context manager measuring the time spent in its block as the named span of the request
+    # being profiled, or doing nothing when the request is not profiled
+    spans_durations = profiled_request_state.spans_durations
+    if spans_durations is None:
+        return no_span
+    return measure_span(spans_durations, span_name)
+
+
+@contextmanager
+def measure_span(spans_durations: dict, span_name: str):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans_durations[span_name] = spans_durations.get(span_name, 0.0) + time.perf_counter() - start_time
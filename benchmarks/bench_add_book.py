@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Book import Book
+from BooksStore import BookStore
+from BooksStorage import BooksStorage
+
+# Measures how long an insert takes as the catalog grows.
+# With amortized O(1) appends the latency per insert should stay flat from 1k to 1M books.
+
+genres_lst = ["SCI_FI", "NOVEL", "HISTORY", "MANGA", "ROMANCE", "PROFESSIONAL"]
+range_of_valid_publication_year = (1940, 2100)
+books_properties = ["id", "title", "author", "price", "year", "genres"]
+
+
+def make_book(i: int) -> Book:
+    return Book(f"Title {i}", f"Author {i % 1000}", 1940 + i % 160, 1 + i % 500, [genres_lst[i % len(genres_lst)]])
+
+
+def bench_storage_append(checkpoints: list, window: int):
+    storage = BooksStorage(books_properties)
+    insert = lambda i: storage.append({"id": i + 1, **make_book(i).get_properties()})
+    return run_checkpoints(insert, checkpoints, window)
+
+
+def bench_store_add_book(checkpoints: list, window: int):
+    book_store = BookStore(genres_lst, range_of_valid_publication_year, books_properties)
+    insert = lambda i: book_store.add_book(make_book(i))
+    return run_checkpoints(insert, checkpoints, window)
+
+
+def run_checkpoints(insert, checkpoints: list, window: int):
+    # Fill the store up to every checkpoint, then time the next `window` inserts at that size
+    results = []
+    num_of_books = 0
+    for checkpoint in checkpoints:
+        while num_of_books < checkpoint:
+            insert(num_of_books)
+            num_of_books += 1
+        start_time = time.perf_counter()
+        for _ in range(window):
+            insert(num_of_books)
+            num_of_books += 1
+        duration = time.perf_counter() - start_time
+        results.append((checkpoint, duration / window * 1e6))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert latency benchmark for the books store")
+    parser.add_argument("--checkpoints", default="1000,10000,100000,1000000",
+                        help="comma separated catalog sizes to measure at")
+    parser.add_argument("--window", type=int, default=1000, help="number of timed inserts per checkpoint")
+    parser.add_argument("--target", choices=["storage", "store"], default="storage",
+                        help="benchmark the raw storage engine or BookStore.add_book")
+    args = parser.parse_args()
+
+    checkpoints = [int(checkpoint) for checkpoint in args.checkpoints.split(",")]
+    bench = bench_storage_append if args.target == "storage" else bench_store_add_book
+    print(f"{'books':>10} | {'us per insert':>14}")
+    for num_of_books, latency in bench(checkpoints, args.window):
+        print(f"{num_of_books:>10} | {latency:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import json
+import math
+import platform
+import sys
+import time
+
+# Saving benchmark results as JSON and comparing them against a baseline run.
+# Results look like {"benchmark": name, "config": {...}, "environment": {...}, "measurements": {case: {metric: value}}}.
+# Metrics ending with _us or _ms are better when lower, metrics ending with _per_s are better when higher,
+# other metrics are informational only.
+
+
+def new_results(benchmark_name: str, config: dict) -> dict:
+    return {"benchmark": benchmark_name, "config": config,
+            "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                            "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "measurements": {}}
+
+
+def save_results(results: dict, path: str):
+    with open(path, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> dict:
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def percentile(sorted_values: list, percent: float):
+    # Nearest rank percentile of already sorted values
+    if len(sorted_values) == 0:
+        return None
+    rank = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float) -> int:
+    # Prints every metric next to its baseline value, and returns how many of them got worse by more
+    # than the threshold (0.1 means 10%)
+    num_of_regressions = 0
+    print(f"\n{'case':<45} {'metric':<16} {'baseline':>12} {'current':>12} {'change':>9}")
+    for case, metrics in results["measurements"].items():
+        baseline_metrics = baseline["measurements"].get(case)
+        if baseline_metrics is None:
+            continue
+        for metric, value in metrics.items():
+            baseline_value = baseline_metrics.get(metric)
+            direction = metric_direction(metric)
+            if direction == 0 or not baseline_value or value is None:
+                continue
+            change = (value - baseline_value) / baseline_value
+            is_regression = change * direction < -threshold
+            num_of_regressions += is_regression
+            print(f"{case:<45} {metric:<16} {baseline_value:>12.3f} {value:>12.3f} {change:>+8.1%}"
+                  f"{'  REGRESSION' if is_regression else ''}")
+    print(f"\n{num_of_regressions} regressions beyond {threshold:.0%}")
+    return num_of_regressions
+
+
+def metric_direction(metric: str) -> int:
+    # 1 when a higher value is better, -1 when a lower value is better, 0 when it is informational
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith("_us") or metric.endswith("_ms"):
+        return -1
+    return 0
@@ -0,0 +1,126 @@
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Book import Book
+from BooksStore import BookStore
+from bench_results import new_results, save_results, load_results, percentile, compare_with_baseline
+
+# Micro-benchmarks of the BookStore operations behind every route, at several catalog sizes.
+# Every case is timed call by call until it ran for --min-time seconds (and at least --min-calls times),
+# and reports the median and p99 latency of a call. The catalog is generated from a fixed seed, so runs
+# with the same arguments measure the same work.
+
+genres_lst = ["SCI_FI", "NOVEL", "HISTORY", "MANGA", "ROMANCE", "PROFESSIONAL"]
+range_of_valid_publication_year = (1940, 2100)
+books_properties = ["id", "title", "author", "price", "year", "genres"]
+num_of_authors = 1000
+
+# Filter mixes passed to get_books, get_sorted_books, count_books and get_books_stats
+filters_mixes = {
+    "no filters": {},
+    "author": {"author": "author 7"},
+    "price range": {"price_bigger_than": 100, "price_less_than": 120},
+    "year range": {"year_bigger_than": 2000, "year_less_than": 2005},
+    "genres": {"genres": ["MANGA"]},
+    "author+genres": {"author": "author 7", "genres": ["NOVEL"]},
+    "price+year+genres": {"price_bigger_than": 50, "price_less_than": 400, "year_bigger_than": 1990,
+                          "genres": ["SCI_FI", "NOVEL"]},
+}
+
+
+def make_book(rnd: random.Random, title: str) -> Book:
+    return Book(title, f"author {rnd.randrange(num_of_authors)}", rnd.randint(1940, 2100), rnd.randint(1, 500),
+                rnd.sample(genres_lst, rnd.randint(1, 3)))
+
+
+def fill_store(num_of_books: int, seed: int) -> BookStore:
+    rnd = random.Random(seed)
+    book_store = BookStore(genres_lst, range_of_valid_publication_year, books_properties)
+    batch_size = 10000
+    for batch_start in range(0, num_of_books, batch_size):
+        batch_end = min(num_of_books, batch_start + batch_size)
+        book_store.add_books([make_book(rnd, f"book {i}") for i in range(batch_start, batch_end)])
+    return book_store
+
+
+def time_calls(call, min_time: float, min_calls: int, max_calls: int = None) -> dict:
+    # Calls call(i) with i = 0, 1, ... and returns the latency statistics of the calls in microseconds
+    durations = []
+    start_time = time.perf_counter()
+    while ((len(durations) < min_calls or time.perf_counter() - start_time < min_time)
+           and (max_calls is None or len(durations) < max_calls)):
+        call_start_time = time.perf_counter()
+        call(len(durations))
+        durations.append(time.perf_counter() - call_start_time)
+    durations.sort()
+    return {"calls": len(durations), "median_us": percentile(durations, 50) * 1e6,
+            "p99_us": percentile(durations, 99) * 1e6, "calls_per_s": len(durations) / sum(durations)}
+
+
+def bench_size(num_of_books: int, args, results: dict):
+    rnd = random.Random(args.seed)
+    load_start_time = time.perf_counter()
+    book_store = fill_store(num_of_books, args.seed)
+    load_duration = time.perf_counter() - load_start_time
+    results["measurements"][f"{num_of_books} books | add_books load"] = {"duration_ms": load_duration * 1e3}
+    print(f"\n{num_of_books} books loaded in {load_duration:.2f}s")
+
+    def measure(case_name: str, call, min_calls: int = args.min_calls, max_calls: int = None):
+        measurement = time_calls(call, args.min_time, min_calls, max_calls)
+        results["measurements"][f"{num_of_books} books | {case_name}"] = measurement
+        print(f"  {case_name:<40} {measurement['median_us']:>12.1f} us median {measurement['p99_us']:>12.1f} us p99"
+              f"  ({measurement['calls']} calls)")
+
+    # The books added are removed right after, so every size is measured with the same catalog
+    added_ids = []
+
+    def add_book(i: int):
+        book_store.add_book(make_book(rnd, f"added book {i}"))
+        added_ids.append(num_of_books + i + 1)
+
+    measure("add_book", add_book)
+    measure("remove_book_by_id", lambda i: book_store.remove_book_by_id(added_ids[i]), min_calls=len(added_ids),
+            max_calls=len(added_ids))
+    ids = [rnd.randint(1, num_of_books) for _ in range(10000)]
+    measure("get_book_by_id", lambda i: book_store.get_book_by_id(ids[i % len(ids)], as_dict=True))
+    measure("update_book_price", lambda i: book_store.update_book_price(ids[i % len(ids)], 1 + i % 500))
+    for mix_name, filters in filters_mixes.items():
+        measure(f"get_books [{mix_name}]", lambda i: book_store.get_books(**filters), min_calls=3)
+        measure(f"get_sorted_books [{mix_name}]", lambda i: book_store.get_sorted_books(**filters), min_calls=3)
+        measure(f"count_books [{mix_name}]", lambda i: book_store.count_books(**filters), min_calls=3)
+        measure(f"get_books_stats [{mix_name}]", lambda i: book_store.get_books_stats(**filters), min_calls=3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the BookStore operations")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma separated catalog sizes to measure at")
+    parser.add_argument("--min-time", type=float, default=0.5, help="minimal number of seconds to time every case")
+    parser.add_argument("--min-calls", type=int, default=100, help="minimal number of timed calls of every case")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated catalog and requests")
+    parser.add_argument("--output", help="save the results as JSON to this path")
+    parser.add_argument("--baseline", help="compare the results with the JSON results saved at this path")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = new_results("bench_store", {"sizes": sizes, "min_time": args.min_time,
+                                          "min_calls": args.min_calls, "seed": args.seed})
+    for num_of_books in sizes:
+        bench_size(num_of_books, args, results)
+        gc.collect()
+
+    if args.output:
+        save_results(results, args.output)
+    if args.baseline:
+        num_of_regressions = compare_with_baseline(results, load_results(args.baseline), args.threshold)
+        sys.exit(1 if num_of_regressions > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from BooksStore import BookStore
+from BookStoreServer import BookStoreServer
+from bench_results import new_results, save_results, load_results, percentile, compare_with_baseline
+
+# HTTP load generator: client threads send a mix of reads and writes covering every route of
+# BookStoreServer, for a fixed duration, and the throughput and latency percentiles of every route are
+# reported. By default it starts a local server preloaded with --books books; with --url it targets a
+# server that is already running (for example main.py with BOOKSTORE_WORKERS set).
+
+genres_lst = ["SCI_FI", "NOVEL", "HISTORY", "MANGA", "ROMANCE", "PROFESSIONAL"]
+range_of_valid_publication_year = (1940, 2100)
+books_properties = ["id", "title", "author", "price", "year", "genres"]
+num_of_authors = 1000
+
+
+def random_book(rnd: random.Random, title: str) -> dict:
+    return {"title": title, "author": f"author {rnd.randrange(num_of_authors)}", "year": rnd.randint(1940, 2100),
+            "price": rnd.randint(1, 500), "genres": rnd.sample(genres_lst, rnd.randint(1, 3))}
+
+
+def random_ids(rnd: random.Random, state: dict) -> str:
+    return ",".join(str(rnd.randint(1, state["max_id"])) for _ in range(20))
+
+
+def random_filters(rnd: random.Random) -> str:
+    filters = []
+    if rnd.random() < 0.3:
+        filters.append(f"author=author%20{rnd.randrange(num_of_authors)}")
+    if rnd.random() < 0.4:
+        low_price = rnd.randint(1, 450)
+        filters.append(f"price-bigger-than={low_price}&price-less-than={low_price + 50}")
+    if rnd.random() < 0.3:
+        filters.append(f"year-bigger-than={rnd.randint(1940, 2090)}")
+    if rnd.random() < 0.4:
+        filters.append(f"genres={','.join(rnd.sample(genres_lst, rnd.randint(1, 2)))}")
+    return "&".join(filters)
+
+
+# Every request kind, as (route name, weight, make request), where make request returns (method, path, body)
+read_requests = [
+    ("GET /", 1, lambda rnd, state: ("GET", "/", None)),
+    ("GET /books/health", 2, lambda rnd, state: ("GET", "/books/health", None)),
+    ("GET /books/total", 15, lambda rnd, state: ("GET", f"/books/total?{random_filters(rnd)}", None)),
+    ("GET /books", 15, lambda rnd, state: ("GET", f"/books?{random_filters(rnd)}", None)),
+    ("GET /books page", 10, lambda rnd, state: ("GET", f"/books?limit=50&{random_filters(rnd)}", None)),
+    ("GET /book", 30, lambda rnd, state: ("GET", f"/book?id={rnd.randint(1, state['max_id'])}", None)),
+    ("GET /books/stats", 3, lambda rnd, state: ("GET", f"/books/stats?{random_filters(rnd)}", None)),
+    ("GET /books/search", 5, lambda rnd, state: ("GET", f"/books/search?q=book%20{rnd.randrange(1000)}", None)),
+    ("GET /books/bulk", 3, lambda rnd, state: ("GET", f"/books/bulk?ids={random_ids(rnd, state)}", None)),
+    ("GET /logs/level", 1, lambda rnd, state: ("GET", f"/logs/level?logger-name={rnd.choice(['request-logger', 'books-logger'])}", None)),
+    ("GET /cache/stats", 1, lambda rnd, state: ("GET", "/cache/stats", None)),
+    ("GET /metrics", 1, lambda rnd, state: ("GET", "/metrics", None)),
+    ("GET /profiling", 1, lambda rnd, state: ("GET", "/profiling", None)),
+]
+write_requests = [
+    ("POST /book", 40, lambda rnd, state: ("POST", "/book", random_book(rnd, f"load book {rnd.getrandbits(64)}"))),
+    ("POST /books/bulk", 5, lambda rnd, state: ("POST", "/books/bulk",
+                                                [random_book(rnd, f"load book {rnd.getrandbits(64)}") for _ in range(20)])),
+    ("PUT /book", 35, lambda rnd, state: ("PUT", f"/book?id={rnd.randint(1, state['max_id'])}&price={rnd.randint(1, 500)}", None)),
+    ("DELETE /book", 19, lambda rnd, state: ("DELETE", f"/book?id={rnd.randint(1, state['max_id'])}", None)),
+    ("PUT /books/bulk", 3, lambda rnd, state: ("PUT", "/books/bulk",
+                                               {str(rnd.randint(1, state["max_id"])): rnd.randint(1, 500) for _ in range(20)})),
+    ("DELETE /books/bulk", 1, lambda rnd, state: ("DELETE", f"/books/bulk?ids={random_ids(rnd, state)}", None)),
+    # Sets the level the loggers already have, so the load doesn't change what is logged
+    ("PUT /logs/level", 1, lambda rnd, state: ("PUT", "/logs/level?logger-name=books-logger&logger-level=INFO", None)),
+]
+
+
+def send(base_url: str, method: str, path: str, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    http_request = urllib.request.Request(base_url + path, data=data, method=method,
+                                          headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as error:
+        error.read()
+        return error.code
+
+
+def client(base_url: str, client_num: int, args, state: dict, durations_of_route: dict, lock: threading.Lock):
+    rnd = random.Random(args.seed * 1000 + client_num)
+    read_weights = [weight for _, weight, _ in read_requests]
+    write_weights = [weight for _, weight, _ in write_requests]
+    client_durations_of_route = {}
+    client_errors_of_route = {}
+    end_time = time.perf_counter() + args.duration
+    while time.perf_counter() < end_time:
+        if rnd.random() < args.write_ratio:
+            route_name, _, make_request = rnd.choices(write_requests, write_weights)[0]
+        else:
+            route_name, _, make_request = rnd.choices(read_requests, read_weights)[0]
+        method, path, body = make_request(rnd, state)
+        start_time = time.perf_counter()
+        try:
+            status = send(base_url, method, path, body)
+        except OSError:
+            status = None
+        client_durations_of_route.setdefault(route_name, []).append(time.perf_counter() - start_time)
+        # Not found and conflict answers are expected under a random mix, anything else is an error
+        if status not in (200, 404, 409):
+            client_errors_of_route[route_name] = client_errors_of_route.get(route_name, 0) + 1
+    with lock:
+        for route_name, durations in client_durations_of_route.items():
+            durations_of_route.setdefault(route_name, []).extend(durations)
+        for route_name, num_of_errors in client_errors_of_route.items():
+            state["errors"][route_name] = state["errors"].get(route_name, 0) + num_of_errors
+
+
+def start_local_server(num_of_books: int, seed: int) -> str:
+    book_store = BookStore(genres_lst, range_of_valid_publication_year, books_properties)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = BookStoreServer(host="127.0.0.1", port=port, book_store=book_store)
+    # Keep the console quiet, the log files are still written
+    logging.getLogger("request-logger").handlers[0].setLevel(logging.ERROR)
+    threading.Thread(target=server.run, daemon=True).start()
+
+    base_url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            urllib.request.urlopen(base_url + "/books/health").close()
+            break
+        except urllib.error.URLError:
+            time.sleep(0.05)
+    rnd = random.Random(seed)
+    batch_size = 10000
+    for batch_start in range(0, num_of_books, batch_size):
+        batch = [random_book(rnd, f"book {i}") for i in range(batch_start, min(num_of_books, batch_start + batch_size))]
+        send(base_url, "POST", "/books/bulk", batch)
+    return base_url
+
+
+def summarize(durations: list, num_of_errors: int, run_duration: float) -> dict:
+    durations = sorted(durations)
+    return {"requests": len(durations), "errors": num_of_errors, "requests_per_s": len(durations) / run_duration,
+            "p50_ms": percentile(durations, 50) * 1e3, "p90_ms": percentile(durations, 90) * 1e3,
+            "p99_ms": percentile(durations, 99) * 1e3, "max_ms": durations[-1] * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test for BookStoreServer")
+    parser.add_argument("--url", help="base URL of a running server, a local server is started when not given")
+    parser.add_argument("--books", type=int, default=10000, help="number of books loaded into the local server")
+    parser.add_argument("--clients", type=int, default=16, help="number of concurrent client threads")
+    parser.add_argument("--duration", type=float, default=10.0, help="number of seconds to send requests for")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="share of the requests that change the catalog")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the preloaded catalog and of the requests")
+    parser.add_argument("--output", help="save the results as JSON to this path")
+    parser.add_argument("--baseline", help="compare the results with the JSON results saved at this path")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/") if args.url else start_local_server(args.books, args.seed)
+    total_response = json.loads(urllib.request.urlopen(base_url + "/books/total").read())
+    state = {"max_id": max(1, total_response["result"]), "errors": {}}
+    durations_of_route = {}
+    lock = threading.Lock()
+    clients = [threading.Thread(target=client, args=(base_url, client_num, args, state, durations_of_route, lock))
+               for client_num in range(args.clients)]
+    start_time = time.perf_counter()
+    for client_thread in clients:
+        client_thread.start()
+    for client_thread in clients:
+        client_thread.join()
+    run_duration = time.perf_counter() - start_time
+
+    results = new_results("load_test", {"url": args.url, "books": None if args.url else args.books,
+                                        "clients": args.clients, "duration": args.duration,
+                                        "write_ratio": args.write_ratio, "seed": args.seed})
+    all_durations = [duration for durations in durations_of_route.values() for duration in durations]
+    results["measurements"]["all routes"] = summarize(all_durations, sum(state["errors"].values()), run_duration)
+    for route_name in sorted(durations_of_route):
+        results["measurements"][route_name] = summarize(durations_of_route[route_name],
+                                                        state["errors"].get(route_name, 0), run_duration)
+
+    print(f"{'route':<20} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for route_name, measurement in results["measurements"].items():
+        print(f"{route_name:<20} {measurement['requests']:>9} {measurement['errors']:>7} "
+              f"{measurement['requests_per_s']:>9.1f} {measurement['p50_ms']:>9.2f} {measurement['p90_ms']:>9.2f} "
+              f"{measurement['p99_ms']:>9.2f} {measurement['max_ms']:>9.2f}")
+
+    if args.output:
+        save_results(results, args.output)
+    if args.baseline:
+        num_of_regressions = compare_with_baseline(results, load_results(args.baseline), args.threshold)
+        sys.exit(1 if num_of_regressions > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
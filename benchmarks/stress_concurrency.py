@@ -0,0 +1,152 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from BooksStore import BookStore
+from BookStoreServer import BookStoreServer
+
+# Concurrency stress test: many client threads hit a multi-threaded server with a mix of reads and
+# writes, then the request numbering and the catalog are checked for consistency.
+
+genres_lst = ["SCI_FI", "NOVEL", "HISTORY", "MANGA", "ROMANCE", "PROFESSIONAL"]
+range_of_valid_publication_year = (1940, 2100)
+books_properties = ["id", "title", "author", "price", "year", "genres"]
+
+
+class RequestNumbersHandler(logging.Handler):
+    # Collects the number the server gave to every incoming request
+    def __init__(self):
+        super().__init__()
+        self.request_nums = []
+        self.__lock = threading.Lock()
+
+    def emit(self, record):
+        match = re.match(r"Incoming request \| #(\d+) \|", record.getMessage())
+        if match:
+            with self.__lock:
+                self.request_nums.append(int(match.group(1)))
+
+
+def call(base_url: str, method: str, path: str, body: dict = None):
+    data = json.dumps(body).encode() if body is not None else None
+    http_request = urllib.request.Request(base_url + path, data=data, method=method,
+                                          headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read() or b"null")
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def client(base_url: str, client_num: int, num_of_requests: int, stats: dict, stats_lock: threading.Lock):
+    rnd = random.Random(client_num)
+    added, removed, num_of_requests_sent = 0, 0, 0
+    for i in range(num_of_requests):
+        action = rnd.random()
+        if action < 0.3:
+            # Every client also races the others to create the same shared titles
+            title = f"shared {rnd.randrange(50)}" if rnd.random() < 0.3 else f"client {client_num} book {i}"
+            book = {"title": title, "author": f"author {rnd.randrange(20)}", "year": rnd.randint(1940, 2100),
+                    "price": rnd.randint(1, 500), "genres": rnd.sample(genres_lst, 2)}
+            status, _ = call(base_url, "POST", "/book", book)
+            added += status == 200
+        elif action < 0.4:
+            status, _ = call(base_url, "DELETE", f"/book?id={rnd.randint(1, stats['max_id'])}")
+            removed += status == 200
+        elif action < 0.5:
+            call(base_url, "PUT", f"/book?id={rnd.randint(1, stats['max_id'])}&price={rnd.randint(1, 500)}")
+        elif action < 0.7:
+            call(base_url, "GET", f"/books?genres={rnd.choice(genres_lst)}&price-less-than={rnd.randint(1, 500)}")
+        elif action < 0.85:
+            call(base_url, "GET", "/books/total")
+        else:
+            call(base_url, "GET", f"/book?id={rnd.randint(1, stats['max_id'])}")
+        num_of_requests_sent += 1
+    with stats_lock:
+        stats["added"] += added
+        stats["removed"] += removed
+        stats["requests"] += num_of_requests_sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency stress test for BookStoreServer")
+    parser.add_argument("--clients", type=int, default=16, help="number of concurrent client threads")
+    parser.add_argument("--requests", type=int, default=300, help="number of requests per client")
+    args = parser.parse_args()
+
+    book_store = BookStore(genres_lst, range_of_valid_publication_year, books_properties)
+    port = find_free_port()
+    server = BookStoreServer(host="127.0.0.1", port=port, book_store=book_store)
+    request_numbers_handler = RequestNumbersHandler()
+    logging.getLogger("request-logger").addHandler(request_numbers_handler)
+    logging.getLogger("request-logger").handlers[0].setLevel(logging.ERROR)  # keep the console quiet
+    threading.Thread(target=server.run, daemon=True).start()
+
+    base_url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            urllib.request.urlopen(base_url + "/books/health").close()
+            break
+        except urllib.error.URLError:
+            time.sleep(0.05)
+
+    stats = {"added": 0, "removed": 0, "requests": 1,  # The health check above was a request too
+             "max_id": args.clients * args.requests // 3}
+    stats_lock = threading.Lock()
+    clients = [threading.Thread(target=client, args=(base_url, client_num, args.requests, stats, stats_lock))
+               for client_num in range(args.clients)]
+    start_time = time.perf_counter()
+    for client_thread in clients:
+        client_thread.start()
+    for client_thread in clients:
+        client_thread.join()
+    duration = time.perf_counter() - start_time
+
+    _, books_response = call(base_url, "GET", "/books")
+    _, total_response = call(base_url, "GET", "/books/total")
+    stats["requests"] += 2
+    books = books_response["result"]
+    titles = [book["title"].lower() for book in books]
+    ids = [book["id"] for book in books]
+
+    failures = []
+    expected_request_nums = list(range(1, stats["requests"] + 1))
+    if sorted(request_numbers_handler.request_nums) != expected_request_nums:
+        failures.append("request numbers are not unique and consecutive")
+    if total_response["result"] != len(books):
+        failures.append(f"/books/total says {total_response['result']} but /books returned {len(books)} books")
+    if len(books) != stats["added"] - stats["removed"]:
+        failures.append(f"{stats['added']} books added and {stats['removed']} removed, but {len(books)} are in the store")
+    if len(set(titles)) != len(titles):
+        failures.append("a title is in the store more than once")
+    if len(set(ids)) != len(ids):
+        failures.append("an id is in the store more than once")
+    if titles != sorted(titles):
+        failures.append("/books is not sorted by title")
+
+    print(f"{stats['requests']} requests from {args.clients} clients in {duration:.2f}s "
+          f"({stats['requests'] / duration:.0f} requests/s), {len(books)} books in the store")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
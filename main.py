@@ -1,6 +1,7 @@
 from BookStoreServer import BookStoreServer
 from BooksStore import BookStore
 import sys
+import os
 import logging
 import click
 
@@ -28,8 +29,20 @@ if __name__ == "__main__":
 
     book_store = BookStore(genres_lst, range_of_valid_publication_year, books_properties)
 
-    server = BookStoreServer(host="0.0.0.0", port=8574, book_store=book_store)
-    server.run()
+    # Number of worker processes serving requests, or "auto" for as many as the memory and the CPUs allow,
+    # see BookStoreServer.run
+    num_of_workers = os.environ.get("BOOKSTORE_WORKERS", "auto")
+    num_of_workers = None if num_of_workers == "auto" else int(num_of_workers)
+
+    # Directory keeping the catalog across restarts, the catalog lives in memory only when it isn't set
+    data_directory = os.environ.get("BOOKSTORE_DATA_DIR")
+
+    # Share of the requests profiled from the start, see GET /profiling
+    profiling_sample_rate = float(os.environ.get("BOOKSTORE_PROFILING_SAMPLE_RATE", "0"))
+
+    server = BookStoreServer(host="0.0.0.0", port=8574, book_store=book_store, data_directory=data_directory,
+                             profiling_sample_rate=profiling_sample_rate)
+    server.run(num_of_workers)
 
 
 